@@ -0,0 +1,20 @@
+from .service import (
+    AppRoleAssignmentService,
+    AppRoleAssignmentServiceError,
+    AppRoleAssignmentResult,
+    AppRoleAssignmentTarget,
+)
+from .snapshot import Snapshot, SnapshotDiff, SnapshotError, diff_snapshots
+from .plan import AppRoleAssignmentPlan
+
+__all__ = [
+    'AppRoleAssignmentService',
+    'AppRoleAssignmentServiceError',
+    'AppRoleAssignmentResult',
+    'AppRoleAssignmentTarget',
+    'AppRoleAssignmentPlan',
+    'Snapshot',
+    'SnapshotDiff',
+    'SnapshotError',
+    'diff_snapshots',
+]
@@ -7,3 +7,10 @@ COMMAND = 'command'
 APP_ROLE_DISPLAY_NAME = 'appRoleDisplayName'
 APPLICATION_DISPLAY_NAME = 'applicationDisplayName'
 GROUP_DISPLAY_NAME = 'groupDisplayName'
+ASSIGN_TO = 'assignTo'
+
+# Assignment targets
+ASSIGN_TO_GROUP = 'group'
+ASSIGN_TO_USERS = 'users'
+ASSIGN_TO_AUTO = 'auto'
+ASSIGN_TO_CHOICES = (ASSIGN_TO_GROUP, ASSIGN_TO_USERS, ASSIGN_TO_AUTO)
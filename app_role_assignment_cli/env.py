@@ -10,7 +10,7 @@ ENVIRONMENT = os.environ['ENVIRONMENT']
 AWS_REGION = os.getenv('AWS_REGION')
 if AWS_REGION is None:
     AWS_REGION = 'eu-west-1'
-    logger.warning(f'AWS_REGION environment variable not found, defaulting to {AWS_REGION}')
+    logger.warning('AWS_REGION environment variable not found, defaulting to %s', AWS_REGION)
 
 AWS_ACCESS_KEY_ID = os.environ['AWS_ACCESS_KEY_ID']
 AWS_SECRET_ACCESS_KEY = os.environ['AWS_SECRET_ACCESS_KEY']
@@ -4,6 +4,22 @@ logger = logging.getLogger(__name__)
 
 
 class AppRoleAssignmentBaseException(Exception):
+    """
+    Base exception of the package. The message is not logged on construction, since many of these errors are
+    expected and swallowed by the per-user loops: the handling code decides whether and at which level to log it.
+    """
     def __init__(self, message, err_logger=logger):
         super().__init__(message)
-        err_logger.error(message)
+        self.err_logger = err_logger
+
+    def log(self, level: int = logging.ERROR):
+        """
+        Log the exception message with the exception logger.
+
+        Args:
+            level: the logging level to use.
+
+        Returns:
+            None.
+        """
+        self.err_logger.log(level, '%s', self, stacklevel=2)
@@ -1,5 +1,10 @@
-import time
+from asyncio import sleep
 from random import random
+from typing import AsyncIterator
+
+from kiota_abstractions.api_error import APIError
+from msgraph.generated.models.app_role_assignment import AppRoleAssignment
+from msgraph.generated.models.service_principal import ServicePrincipal
 
 from app_role_assignment_cli.interfaces.azure.msgraph_api import MSGraphAPIWrapper, Application
 from app_role_assignment_cli.logging_settings import logging
@@ -12,6 +17,14 @@ class MSGraphAPIRequestHandlerError(AppRoleAssignmentBaseException):
     pass
 
 
+class AppRoleAssignmentExistsError(MSGraphAPIRequestHandlerError):
+    """The principal already holds the AppRole."""
+
+
+class GroupAssignmentNotAllowedError(MSGraphAPIRequestHandlerError):
+    """The tenant does not allow Group-level AppRoleAssignments (missing license or permission)."""
+
+
 class MSGraphAPIRequestHandler:
     def __init__(self, api: MSGraphAPIWrapper):
         self.api = api
@@ -34,46 +47,118 @@ class MSGraphAPIRequestHandler:
             if _application is not None:
                 return _application
 
+    async def get_app_service_principal_if_exists(self, app_id: str) -> ServicePrincipal | None:
+        try:
+            return await self.api.get_app_service_principal(app_id)
+        except Exception as e:
+            raise MSGraphAPIRequestHandlerError(f'Could not handle the GET ServicePrincipal request. Occurred {e}')
+
+    async def get_app_role_assigned_to(self, service_principal_id: str) -> list[AppRoleAssignment]:
+        try:
+            app_role_assignments = await self.api.get_app_role_assigned_to(service_principal_id)
+        except Exception as e:
+            raise MSGraphAPIRequestHandlerError(f'Could not handle the GET AppRoleAssignedTo request. Occurred {e}')
+        else:
+            if app_role_assignments is None:
+                raise MSGraphAPIRequestHandlerError(f'GET AppRoleAssignedTo failed for {service_principal_id=}')
+            return app_role_assignments
+
+    async def iter_app_role_assigned_to(self, service_principal_id: str) -> AsyncIterator[list[AppRoleAssignment]]:
+        try:
+            async for page in self.api.iter_app_role_assigned_to(service_principal_id):
+                yield page
+        except Exception as e:
+            raise MSGraphAPIRequestHandlerError(f'Could not handle the GET AppRoleAssignedTo request. Occurred {e}')
+
+    async def count_transitive_members(self, group_id: str) -> tuple[int, int]:
+        try:
+            counts = await self.api.count_transitive_members(group_id)
+        except Exception as e:
+            raise MSGraphAPIRequestHandlerError(f'Could not handle the GET Members $count request. Occurred {e}')
+        else:
+            if counts is None:
+                raise MSGraphAPIRequestHandlerError(f'GET Members $count failed for {group_id=}')
+            return counts
+
     async def get_all_user_ids(self, group_id: str) -> list[str]:
         try:
             users = await self.api.get_all_user_group_members(group_id)
         except Exception as e:
             raise MSGraphAPIRequestHandlerError(f'Could not handle the GET Members request. Occurred {e}')
         else:
-            if users is not None:
-                return [u.id for u in users]
+            return [u.id for u in users]
 
-    async def get_app_role_assignment_id(self, user_id: str, application_display_name, app_role_id: str) -> str:
+    async def get_app_role_assignment_ids(self, user_id: str, application_display_name: str) -> dict[str, str]:
         try:
             app_role_assignments = await self.api.get_app_role_assignments_for_user(user_id, application_display_name)
         except Exception as e:
             raise MSGraphAPIRequestHandlerError(f'Could not handle the GET AppRoleAssignment request. Occurred {e}')
         else:
-            if not app_role_assignments:
-                raise MSGraphAPIRequestHandlerError(
-                    f'Empty set, no AppRoleAssignment found for {user_id=} and {application_display_name=}'
-                )
-            try:
-                app_role_assignment = next(filter(lambda x: str(x.app_role_id) == app_role_id, app_role_assignments))
-            except StopIteration:
-                raise MSGraphAPIRequestHandlerError(f'No AppRoleAssignment found for {app_role_id=}')
-            else:
-                return str(app_role_assignment.id)
+            if app_role_assignments is None:
+                raise MSGraphAPIRequestHandlerError(f'GET AppRoleAssignment failed for {user_id=}')
+            return {str(a.app_role_id): str(a.id) for a in app_role_assignments}
 
     async def grant_app_role_assignment_to_user(self, user_id: str, app_id: str, app_role_id: str):
-        logger.info(f'Granting AppRole({app_role_id}) to User({user_id})')
+        logger.debug('Granting AppRole(%s) to User(%s)', app_role_id, user_id)
         try:
             _res = await self.api.grant_app_role_assignment_to_user(user_id, app_id, app_role_id)
+        except APIError as e:
+            raise AppRoleAssignmentExistsError(f'AppRoleAssignment already exists for {user_id=}: {e}')
         except Exception as e:
             raise MSGraphAPIRequestHandlerError(f'Could not handle the POST AppRoleAssignment request. Occurred {e}')
         else:
-            time.sleep(round(random(), 2))
+            if _res is None:
+                raise MSGraphAPIRequestHandlerError(f'POST AppRoleAssignment failed for {user_id=}')
+            await sleep(round(random(), 2))
 
     async def remove_app_role_assignment_from_user(self, user_id: str, app_role_assignment_id: str):
-        logger.info(f'Removing AppRoleAssignment({app_role_assignment_id}) from User({user_id})')
+        logger.debug('Removing AppRoleAssignment(%s) from User(%s)', app_role_assignment_id, user_id)
         try:
             _res = await self.api.delete_app_role_assignment(user_id, app_role_assignment_id)
         except Exception as e:
             raise MSGraphAPIRequestHandlerError(f'Could not handle the DELETE AppRoleAssignment request. Occurred {e}')
         else:
-            time.sleep(round(random(), 2))
+            if not _res:
+                raise MSGraphAPIRequestHandlerError(f'DELETE AppRoleAssignment failed for {user_id=}')
+            await sleep(round(random(), 2))
+
+    async def get_group_app_role_assignment_id(
+            self, group_id: str, application_display_name: str, app_role_id: str
+    ) -> str | None:
+        try:
+            app_role_assignments = await self.api.get_app_role_assignments_for_group(
+                group_id, application_display_name
+            )
+        except Exception as e:
+            raise MSGraphAPIRequestHandlerError(
+                f'Could not handle the GET Group AppRoleAssignment request. Occurred {e}'
+            )
+        else:
+            # None only when the Group does not hold the AppRole, request errors are raised above
+            return next((str(a.id) for a in app_role_assignments if str(a.app_role_id) == app_role_id), None)
+
+    async def grant_app_role_assignment_to_group(self, group_id: str, app_id: str, app_role_id: str):
+        logger.info('Granting AppRole(%s) to Group(%s)', app_role_id, group_id)
+        try:
+            _res = await self.api.grant_app_role_assignment_to_group(group_id, app_id, app_role_id)
+        except APIError as e:
+            raise GroupAssignmentNotAllowedError(f'POST AppRoleAssignment not allowed for {group_id=}: {e}')
+        except Exception as e:
+            raise MSGraphAPIRequestHandlerError(
+                f'Could not handle the POST Group AppRoleAssignment request. Occurred {e}'
+            )
+        else:
+            if _res is None:
+                raise MSGraphAPIRequestHandlerError(f'POST AppRoleAssignment failed for {group_id=}')
+
+    async def remove_app_role_assignment_from_group(self, group_id: str, app_role_assignment_id: str):
+        logger.info('Removing AppRoleAssignment(%s) from Group(%s)', app_role_assignment_id, group_id)
+        try:
+            _res = await self.api.delete_group_app_role_assignment(group_id, app_role_assignment_id)
+        except Exception as e:
+            raise MSGraphAPIRequestHandlerError(
+                f'Could not handle the DELETE Group AppRoleAssignment request. Occurred {e}'
+            )
+        else:
+            if not _res:
+                raise MSGraphAPIRequestHandlerError(f'DELETE AppRoleAssignment failed for {group_id=}')
@@ -1,4 +1,6 @@
 from asyncio import sleep
+from logging import Logger
+from time import monotonic
 from typing import Generator, Callable
 
 
@@ -42,6 +44,66 @@ async def retry(func: Callable, args=(), kwargs={}, intervals=backoff(), logger=
         except Exception as e:
             exc = e
             if logger:
-                logger.warning(f'Retry attempt {i}: {func.__name__}(*{args}, **{kwargs}) failed: {e}')
+                logger.warning('Retry attempt %d: %s(*%s, **%s) failed: %s', i, func.__name__, args, kwargs, e)
             await sleep(t)
     raise exc
+
+
+class ProgressReporter:
+    """
+    Aggregate the outcome of a per-user loop and periodically log a single progress line (processed count,
+    rate, ETA and error count) instead of one line per user.
+    """
+    def __init__(self, description: str, total: int, logger: Logger, interval: float = 10.):
+        """
+        Args:
+            description: the label of the operation being tracked (e.g. 'Granting AppRole').
+            total: the number of items expected to be processed.
+            logger: the logger used to emit the progress lines.
+            interval: the minimum amount of seconds in between two progress lines.
+        """
+        self.description = description
+        self.total = total
+        self.logger = logger
+        self.interval = interval
+        self.processed = 0
+        self.errors = 0
+        self.skipped = 0
+        self._start = self._last_report = monotonic()
+
+    def update(self, error: bool = False, skipped: bool = False):
+        """
+        Record the outcome of one item and log a progress line if the interval has elapsed.
+
+        Args:
+            error: whether the item failed.
+            skipped: whether the item required no operation.
+
+        Returns:
+            None.
+        """
+        self.processed += 1
+        self.errors += error
+        self.skipped += skipped
+        now = monotonic()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        """
+        Log the current progress: processed/total, errors, skipped, rate (items/s), and ETA. Nothing is logged when
+        there is no item to process.
+
+        Returns:
+            None.
+        """
+        if self.total == 0:
+            return
+        elapsed = monotonic() - self._start
+        rate = self.processed / elapsed if elapsed > 0 else 0.
+        eta = f'{(self.total - self.processed) / rate:.0f}s' if rate > 0 else 'n/a'
+        self.logger.info(
+            '%s: %d/%d processed, %d error(s), %d skipped, %.1f/s, ETA %s',
+            self.description, self.processed, self.total, self.errors, self.skipped, rate, eta
+        )
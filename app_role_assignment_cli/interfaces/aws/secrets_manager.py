@@ -35,7 +35,7 @@ def get_secret(client: BaseClient, secret_id: str) -> dict | None:
         secret = client.get_secret_value(SecretId=secret_id)
     except ClientError as e:
         if e.response['Error']['Code'] == 'ResourceNotFoundException':
-            logger.error(f'Requested secret={secret_id} does not exists.')
+            logger.error('Requested secret=%s does not exists.', secret_id)
             return
         raise e
     else:
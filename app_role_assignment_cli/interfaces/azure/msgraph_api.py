@@ -1,7 +1,12 @@
+from typing import AsyncIterator
 from uuid import UUID
 
+import httpx
+from azure.core.credentials_async import AsyncTokenCredential
 from azure.identity.aio import ClientSecretCredential
-from msgraph import GraphServiceClient
+from kiota_authentication_azure.azure_identity_authentication_provider import AzureIdentityAuthenticationProvider
+from msgraph import GraphServiceClient, GraphRequestAdapter
+from msgraph_core import GraphClientFactory
 from msgraph.generated.models.directory_object import DirectoryObject
 from msgraph.generated.models.application import Application
 from msgraph.generated.models.group import Group
@@ -11,7 +16,13 @@ from msgraph.generated.models.service_principal import ServicePrincipal
 from msgraph.generated.groups.item.app_role_assignments.app_role_assignments_request_builder \
     import AppRoleAssignmentsRequestBuilder
 from msgraph.generated.groups.item.members.members_request_builder import MembersRequestBuilder
+from msgraph.generated.groups.item.transitive_members.graph_user.count.count_request_builder \
+    import CountRequestBuilder as UserCountRequestBuilder
+from msgraph.generated.groups.item.transitive_members.graph_group.count.count_request_builder \
+    import CountRequestBuilder as GroupCountRequestBuilder
 from msgraph.generated.service_principals.service_principals_request_builder import ServicePrincipalsRequestBuilder
+from msgraph.generated.service_principals.item.app_role_assigned_to.app_role_assigned_to_request_builder \
+    import AppRoleAssignedToRequestBuilder
 from msgraph.generated.groups.groups_request_builder import GroupsRequestBuilder
 from msgraph.generated.applications.applications_request_builder import ApplicationsRequestBuilder
 from kiota_abstractions.api_error import APIError
@@ -21,18 +32,66 @@ from app_role_assignment_cli.logging_settings import logging
 logger = logging.getLogger(__name__)
 
 SCOPES = ['https://graph.microsoft.com/.default']
+# Error codes refusing a Group-level appRoleAssignment, as opposed to transient (throttling, server) failures
+GROUP_ASSIGNMENT_NOT_ALLOWED_CODES = ('Authorization_RequestDenied',)
+
+
+def get_error_details(e: APIError) -> tuple[str | None, str]:
+    """
+    Get the Microsoft Graph error code and message carried by an ODataError.
+
+    Args:
+        e: the error raised by the request.
+
+    Returns:
+        tuple: the error code (None if not an ODataError) and the lowercase error message.
+    """
+    error = getattr(e, 'error', None)
+    message = getattr(error, 'message', None) or e.message or ''
+    return getattr(error, 'code', None), message.lower()
+
+
+def is_group_assignment_not_allowed(e: APIError) -> bool:
+    """
+    Whether a Group-level appRoleAssignment was refused for lack of permission or license (Group-based assignment
+    requires Microsoft Entra ID P1 or higher).
+    """
+    code, message = get_error_details(e)
+    return e.response_status_code == 403 or code in GROUP_ASSIGNMENT_NOT_ALLOWED_CODES or 'licens' in message
+
+
+def is_app_role_already_assigned(e: APIError) -> bool:
+    """
+    Whether an appRoleAssignment POST was rejected because the principal already holds the appRole
+    ("Permission being assigned already exists on the object").
+    """
+    _, message = get_error_details(e)
+    return e.response_status_code == 400 and 'already exists' in message
 
 
 class MSGraphAPIWrapper:
     """
     Wrapper class for the Microsoft Graph API.
+
+    The client is authenticated either with the tenant_id/client_id/client_secret triplet, or with an already
+    instantiated async `credential`. An `http_client` can be injected to share the connection pool with the caller.
     """
-    def __init__(self, tenant_id: str, client_id: str, client_secret: str, scopes: list | None = None):
+    def __init__(
+            self,
+            tenant_id: str | None = None,
+            client_id: str | None = None,
+            client_secret: str | None = None,
+            scopes: list | None = None,
+            *,
+            credential: AsyncTokenCredential | None = None,
+            http_client: httpx.AsyncClient | None = None
+    ):
         self.tenant_id = tenant_id
         self.client_id = client_id
         self.client_secret = client_secret
         self.scopes = scopes if scopes is not None else SCOPES
-        self.credential = self._get_client_credential()
+        self.http_client = http_client
+        self.credential = credential if credential is not None else self._get_client_credential()
         self.client = self._get_client()
 
     def _get_client_credential(self) -> ClientSecretCredential:
@@ -51,7 +110,13 @@ class MSGraphAPIWrapper:
         Returns:
             GraphServiceClient: an instance of the GraphServiceClient class.
         """
-        return GraphServiceClient(credentials=self.credential, scopes=self.scopes)
+        if self.http_client is None:
+            return GraphServiceClient(credentials=self.credential, scopes=self.scopes)
+        auth_provider = AzureIdentityAuthenticationProvider(self.credential, scopes=self.scopes)
+        request_adapter = GraphRequestAdapter(
+            auth_provider, client=GraphClientFactory.create_with_default_middleware(client=self.http_client)
+        )
+        return GraphServiceClient(request_adapter=request_adapter)
 
     async def get_group(self, group_display_name: str) -> Group | None:
         """
@@ -77,23 +142,24 @@ class MSGraphAPIWrapper:
         try:
             groups = await self.client.groups.get(request_configuration=request_config)
         except APIError as e:
-            logger.error(f'{e}')
+            logger.error('%s', e)
         else:
             if not groups.value:
-                logger.warning(f'No groups found for filter={query_params.filter}')
+                logger.warning('No groups found for filter=%s', query_params.filter)
                 return
             assert len(groups.value) == 1, f'Unexpected response: {groups=}'
             return groups.value[0]
 
     async def get_all_user_group_members(self, group_id: str) -> list[User]:
         """
-        Get all the id's of the members of a group (by group id).
+        Get all the user members of a group (by group id), nested groups included. Request errors are raised, since
+        a partial listing cannot be told apart from a complete one: a sync would remove the missing holders.
 
         Args:
             group_id: the group id to search for.
 
         Returns:
-            list[str]: the list of user-principal-names of the members of the group.
+            list[User]: the user members of the group.
         """
         async def _extend_user_members(fetched_members: list[DirectoryObject]):
             for member in fetched_members:
@@ -103,33 +169,45 @@ class MSGraphAPIWrapper:
                     case Group():
                         members.extend(await self.get_all_user_group_members(member.id))
                     case _:
-                        logger.warning(f'Skipping {member.__class__} as not supported')
+                        logger.warning('Skipping %s as not supported', member.__class__)
 
         query_params = MembersRequestBuilder.MembersRequestBuilderGetQueryParameters(top=999)
         request_configuration = MembersRequestBuilder.MembersRequestBuilderGetRequestConfiguration(
             query_parameters=query_params
         )
+        request_builder = self.client.groups.by_group_id(group_id).members
         members = []
+        res = await request_builder.get(request_configuration=request_configuration)
+        await _extend_user_members(res.value or [])
+        while res.odata_next_link:
+            res = await request_builder.with_url(res.odata_next_link).get()
+            await _extend_user_members(res.value or [])
+
+        return members
+
+    async def count_transitive_members(self, group_id: str) -> tuple[int, int] | None:
+        """
+        Count the users and the groups among the transitive members of a group, with two $count requests.
+        See https://learn.microsoft.com/en-us/graph/api/group-list-transitivemembers?view=graph-rest-1.0
+
+        Args:
+            group_id: the group id to count the members of.
+
+        Returns:
+            tuple | None: the number of (distinct) users and nested groups, or None on request error.
+        """
+        user_request_configuration = UserCountRequestBuilder.CountRequestBuilderGetRequestConfiguration()
+        user_request_configuration.headers.add("ConsistencyLevel", "eventual")
+        group_request_configuration = GroupCountRequestBuilder.CountRequestBuilderGetRequestConfiguration()
+        group_request_configuration.headers.add("ConsistencyLevel", "eventual")
+        transitive_members = self.client.groups.by_group_id(group_id).transitive_members
         try:
-            res = await self.client.groups.by_group_id(group_id).members.\
-                get(request_configuration=request_configuration)
+            users = await transitive_members.graph_user.count.get(request_configuration=user_request_configuration)
+            groups = await transitive_members.graph_group.count.get(request_configuration=group_request_configuration)
         except APIError as e:
-            logger.error(f'{e}')
+            logger.error('%s', e)
         else:
-            if res.value:
-                await _extend_user_members(res.value)
-                next_link = res.odata_next_link
-                while next_link:
-                    try:
-                        next_members = await self.client.groups.with_url(next_link).get()
-                    except APIError as e:
-                        logger.error(f'Could not fetch more members: {e}')
-                        return members
-                    else:
-                        next_link = next_members.odata_next_link
-                        await _extend_user_members(next_members.value)
-
-        return members
+            return users, groups
 
     async def get_application(self, application_display_name: str) -> Application | None:
         """
@@ -150,10 +228,10 @@ class MSGraphAPIWrapper:
         try:
             applications = await self.client.applications.get(request_configuration=request_config)
         except APIError as e:
-            logger.error(f'{e}')
+            logger.error('%s', e)
         else:
             if not applications.value:
-                logger.warning(f'\'{application_display_name}\' not found!')
+                logger.warning('\'%s\' not found!', application_display_name)
                 return
             assert len(applications.value) == 1, f'More than one application found!: {applications=}'
             return applications.value[0]
@@ -179,15 +257,59 @@ class MSGraphAPIWrapper:
         try:
             res = await self.client.service_principals.get(request_configuration=request_configuration)
         except APIError as e:
-            logger.error(f'{e}')
+            logger.error('%s', e)
             return
         else:
             if not res.value:
-                logger.warning(f'ServicePrincipal for \'{app_id=}\' not found!')
+                logger.warning('ServicePrincipal for \'app_id=%r\' not found!', app_id)
                 return
             assert len(res.value) == 1, f'More than one servicePrincipal found: {res=}'
             return res.value[0]
 
+    async def iter_app_role_assigned_to(self, service_principal_id: str) -> AsyncIterator[list[AppRoleAssignment]]:
+        """
+        Iterate over the pages of the appRoleAssignments granted for the resource servicePrincipal (to users, groups,
+        and servicePrincipals), following the pagination. Request errors are raised, since a partial listing
+        cannot be told apart from a complete one.
+        See https://learn.microsoft.com/en-us/graph/api/serviceprincipal-list-approleassignedto?view=graph-rest-1.0
+
+        Args:
+            service_principal_id: the id of the resource servicePrincipal.
+
+        Returns:
+            AsyncIterator: the pages of AppRoleAssignment objects.
+        """
+        query_params = AppRoleAssignedToRequestBuilder.AppRoleAssignedToRequestBuilderGetQueryParameters(top=999)
+        request_configuration = AppRoleAssignedToRequestBuilder.\
+            AppRoleAssignedToRequestBuilderGetRequestConfiguration(query_parameters=query_params)
+        request_builder = self.client.service_principals.by_service_principal_id(service_principal_id).\
+            app_role_assigned_to
+        res = await request_builder.get(request_configuration=request_configuration)
+        yield list(res.value or [])
+        while res.odata_next_link:
+            res = await request_builder.with_url(res.odata_next_link).get()
+            yield list(res.value or [])
+
+    async def get_app_role_assigned_to(self, service_principal_id: str) -> list[AppRoleAssignment] | None:
+        """
+        Retrieve all the appRoleAssignments granted for the resource servicePrincipal.
+
+        Args:
+            service_principal_id: the id of the resource servicePrincipal.
+
+        Returns:
+            list | None: a list of AppRoleAssignment objects or None on request error.
+        """
+        app_role_assignments = []
+        try:
+            async for page in self.iter_app_role_assigned_to(service_principal_id):
+                app_role_assignments.extend(page)
+        except APIError as e:
+            logger.error('%s', e)
+        else:
+            logger.debug('Found %d AppRoleAssignment(s) for %s', len(app_role_assignments), service_principal_id)
+            return app_role_assignments
+
     async def get_app_role_assignments_for_user(
             self, user_id: str, resource_display_name: str
     ) -> list[AppRoleAssignment] | None:
@@ -214,9 +336,12 @@ class MSGraphAPIWrapper:
             res = await self.client.users.by_user_id(user_id).app_role_assignments.\
                 get(request_configuration=request_configuration)
         except APIError as e:
-            logger.error(f'{e}')
+            # Per-user failures are counted by the caller, logged at DEBUG to keep the hot path quiet
+            logger.debug('%s', e)
         else:
-            logger.info(f'Found {len(res.value)} AppRoleAssignment(s) for {resource_display_name=}')
+            logger.debug(
+                'Found %d AppRoleAssignment(s) for resource_display_name=%r', len(res.value), resource_display_name
+            )
             return [r for r in res.value if r.principal_type == 'User']
 
     async def grant_app_role_assignment_to_user(
@@ -224,7 +349,7 @@ class MSGraphAPIWrapper:
             user_id: str,
             resource_id: str,
             app_role_id: str
-    ) -> None:
+    ) -> AppRoleAssignment | None:
         """
         Assign an app role to a user, creating an appRoleAssignment object.
         To grant an app role assignment to a user, we need the three identifiers in args.
@@ -236,7 +361,8 @@ class MSGraphAPIWrapper:
             app_role_id: The id of the appRole (defined on the resource service principal) to assign to the user.
 
         Returns:
-            None.
+            AppRoleAssignment | None: the created AppRoleAssignment or None on request error. The APIError is raised
+            when the user already holds the appRole (see `is_app_role_already_assigned`).
         """
         request_body = AppRoleAssignment(
             principal_id=UUID(user_id),
@@ -246,11 +372,15 @@ class MSGraphAPIWrapper:
         try:
             result = await self.client.users.by_user_id(user_id).app_role_assignments.post(request_body)
         except APIError as e:
-            logger.error(f'{e}')
+            if is_app_role_already_assigned(e):
+                # Raised, so the caller can record the user as skipped rather than failed
+                raise
+            logger.debug('%s', e)
         else:
-            logger.info(f'Granted {result.resource_display_name} to {user_id=}')
+            logger.debug('Granted %s to user_id=%r', result.resource_display_name, user_id)
+            return result
 
-    async def delete_app_role_assignment(self, user_id: str, app_role_assignment_id: str) -> None:
+    async def delete_app_role_assignment(self, user_id: str, app_role_assignment_id: str) -> bool:
         """
         See https://learn.microsoft.com/en-us/graph/api/user-delete-approleassignments?view=graph-rest-1.0&tabs=python
 
@@ -259,12 +389,100 @@ class MSGraphAPIWrapper:
             app_role_assignment_id:
 
         Returns:
-            None.
+            bool: True if the AppRoleAssignment was deleted, False on request error.
         """
         try:
             _ = await self.client.users.by_user_id(user_id).app_role_assignments.\
                 by_app_role_assignment_id(app_role_assignment_id).delete()
         except APIError as e:
-            logger.error(f'{e}')
+            logger.debug('%s', e)
+            return False
+        else:
+            logger.debug('Deleted AppRoleAssignment(%s) from user_id=%r', app_role_assignment_id, user_id)
+            return True
+
+    async def get_app_role_assignments_for_group(
+            self, group_id: str, resource_display_name: str
+    ) -> list[AppRoleAssignment]:
+        """
+        Retrieve the appRoleAssignments granted to the group itself (not to its members) for a specific resource.
+        Request errors are raised, so that a failed lookup is not mistaken for a group holding no appRoleAssignment.
+        See https://learn.microsoft.com/en-us/graph/api/group-list-approleassignments?view=graph-rest-1.0&tabs=python
+
+        Args:
+            group_id: the id of the group we want to retrieve the appRoleAssignments.
+            resource_display_name: the display name of the resource (application) assigning the app roles to the group.
+
+        Returns:
+            list: a list of AppRoleAssignment objects.
+        """
+        query_params = AppRoleAssignmentsRequestBuilder.AppRoleAssignmentsRequestBuilderGetQueryParameters(
+            filter=f"resourceDisplayName eq '{resource_display_name}'",
+            count=True,
+        )
+        request_configuration = AppRoleAssignmentsRequestBuilder.\
+            AppRoleAssignmentsRequestBuilderGetRequestConfiguration(query_parameters=query_params)
+        request_configuration.headers.add("ConsistencyLevel", "eventual")
+        res = await self.client.groups.by_group_id(group_id).app_role_assignments.\
+            get(request_configuration=request_configuration)
+        logger.debug(
+            'Found %d group AppRoleAssignment(s) for resource_display_name=%r', len(res.value), resource_display_name
+        )
+        return [r for r in res.value if r.principal_type == 'Group']
+
+    async def grant_app_role_assignment_to_group(
+            self,
+            group_id: str,
+            resource_id: str,
+            app_role_id: str
+    ) -> AppRoleAssignment | None:
+        """
+        Assign an app role to a group, creating a single appRoleAssignment object inherited by all its direct members.
+        Group-based assignment requires a Microsoft Entra ID P1 (or higher) license: the request fails otherwise.
+        See https://learn.microsoft.com/en-us/graph/api/group-post-approleassignments?view=graph-rest-1.0&tabs=python
+
+        Args:
+            group_id: The id of the group to whom you are assigning the app role.
+            resource_id: The id of the resource servicePrincipal that has defined the app role.
+            app_role_id: The id of the appRole (defined on the resource service principal) to assign to the group.
+
+        Returns:
+            AppRoleAssignment | None: the created AppRoleAssignment or None on request error. The APIError is raised
+            when the assignment is not allowed (see `is_group_assignment_not_allowed`).
+        """
+        request_body = AppRoleAssignment(
+            principal_id=UUID(group_id),
+            resource_id=UUID(resource_id),
+            app_role_id=UUID(app_role_id),
+        )
+        try:
+            result = await self.client.groups.by_group_id(group_id).app_role_assignments.post(request_body)
+        except APIError as e:
+            if is_group_assignment_not_allowed(e):
+                # Raised, so the caller can fall back to the members only when the assignment is not allowed
+                raise
+            logger.error('%s', e)
+        else:
+            logger.info('Granted %s to group_id=%r', result.resource_display_name, group_id)
+            return result
+
+    async def delete_group_app_role_assignment(self, group_id: str, app_role_assignment_id: str) -> bool:
+        """
+        See https://learn.microsoft.com/en-us/graph/api/group-delete-approleassignments?view=graph-rest-1.0&tabs=python
+
+        Args:
+            group_id: the id of the group holding the appRoleAssignment.
+            app_role_assignment_id: the id of the appRoleAssignment to delete.
+
+        Returns:
+            bool: True if the AppRoleAssignment was deleted, False on request error.
+        """
+        try:
+            _ = await self.client.groups.by_group_id(group_id).app_role_assignments.\
+                by_app_role_assignment_id(app_role_assignment_id).delete()
+        except APIError as e:
+            logger.error('%s', e)
+            return False
         else:
-            logger.info(f'Deleted AppRoleAssignment({app_role_assignment_id}) from {user_id=}')
+            logger.info('Deleted AppRoleAssignment(%s) from group_id=%r', app_role_assignment_id, group_id)
+            return True
@@ -1,8 +1,47 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 
-logging.basicConfig(
-    level=logging.getLevelName(os.getenv('LOG_LEVEL', 'INFO')),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(module)s - %(funcName)s - %(message)s',
-    handlers=[logging.StreamHandler(),]
-)
+LOG_FORMAT = \
+    '%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(module)s - %(funcName)s - %(message)s'
+
+# When LOG_ASYNC is enabled (default) records are put on an in-memory queue by a QueueHandler and written to stderr
+# by a QueueListener running in a background thread, so the callers never block on the stream I/O.
+LOG_ASYNC = os.getenv('LOG_ASYNC', '1').lower() not in ('0', 'false', 'no')
+
+
+def _get_handlers() -> list[logging.Handler]:
+    """
+    Build the root handlers: a QueueHandler feeding a started QueueListener, or a plain StreamHandler.
+
+    Returns:
+        list[logging.Handler]: the handlers to be installed on the root logger.
+    """
+    stream_handler = logging.StreamHandler()
+    if not LOG_ASYNC:
+        return [stream_handler,]
+
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    # Flush the pending records on interpreter shutdown (including sys.exit)
+    atexit.register(listener.stop)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # The listener's handler applies LOG_FORMAT, the queue handler only merges the message with its arguments
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    return [queue_handler,]
+
+
+def configure_logging() -> None:
+    """
+    Configure the root logger from LOG_LEVEL and LOG_ASYNC. Called once by the CLI entry point, the library modules
+    only get their loggers so that importing the package leaves the logging configuration to the caller.
+    """
+    logging.basicConfig(
+        level=logging.getLevelName(os.getenv('LOG_LEVEL', 'INFO')),
+        format=LOG_FORMAT,
+        handlers=_get_handlers()
+    )
@@ -1,11 +1,10 @@
 import asyncio
+from datetime import datetime
 from os import getenv
 import sys
 from pathlib import Path
 
 import click
-from msgraph.generated.models.application import Application
-from msgraph.generated.models.app_role import AppRole
 from yaml import safe_load
 
 from .constants import (
@@ -15,150 +14,136 @@ from .constants import (
     COMMAND,
     APP_ROLE_DISPLAY_NAME,
     APPLICATION_DISPLAY_NAME,
-    GROUP_DISPLAY_NAME
+    GROUP_DISPLAY_NAME,
+    ASSIGN_TO,
+    ASSIGN_TO_USERS,
+    ASSIGN_TO_CHOICES
 )
 from .env import ENVIRONMENT
-from .logging_settings import logging
-from .helpers import get_azure_credentials, get_app_role_if_exists
+from .logging_settings import configure_logging, logging
+from .helpers import get_azure_credentials
 from .interfaces.aws.secrets_manager import get_client
-from .interfaces.azure.msgraph_api import MSGraphAPIWrapper
-from .handlers.azure import MSGraphAPIRequestHandler, MSGraphAPIRequestHandlerError
+from .service import AppRoleAssignmentService, AppRoleAssignmentServiceError, AppRoleAssignmentResult
+from .snapshot import Snapshot, SnapshotError, diff_snapshots
+from .plan import AppRoleAssignmentPlan
 
 logger = logging.getLogger(__name__)
 
 SECRET_ID = getenv('SECRET_ID', f'app-role-assignment-cli/dap/{ENVIRONMENT.lower()}/azure_credentials')
 
 
-def get_app_group_id_app_role_objects(
-    _runner: asyncio.Runner,
-    *,
-    msgraph_api_handler: MSGraphAPIRequestHandler,
-    group_display_name: str,
-    application_display_name: str,
-    app_role_display_name: str
-) -> tuple[Application, str, AppRole]:
+def get_service(concurrency: int = 1) -> AppRoleAssignmentService:
     """
-    Get common objects used for the main flows.
+    Instantiate the AppRoleAssignmentService with the Azure credentials stored in AWS Secrets Manager.
 
     Args:
-        _runner: an asyncio Runner instance
-        msgraph_api_handler: an MSGraphAPIRequestHandler instance
-        group_display_name: the Group displayName
-        application_display_name: the Application displayName
-        app_role_display_name: the AppRole displayName
+        concurrency: the max number of per-user requests in flight.
 
     Returns:
-        tuple: the Application object, the Group id, and the AppRole object
+        AppRoleAssignmentService: the service instance.
     """
-    group_id = _runner.run(msgraph_api_handler.get_group_id_if_exists(group_display_name))
-    if group_id is None:
-        sys.exit(f'\'{group_display_name}\' most likely misspelled!')
-
-    app = _runner.run(msgraph_api_handler.get_application_if_exists(application_display_name))
-    if app is None:
-        sys.exit(f'\'{application_display_name}\' most likely misspelled!')
-
-    app_role = get_app_role_if_exists(app_role_display_name, app)
-    if app_role is None:
-        sys.exit(f'\'{app_role_display_name}\' most likely misspelled!')
-
-    return app, group_id, app_role
+    az_creds = get_azure_credentials(get_client(), SECRET_ID)
+    return AppRoleAssignmentService.from_client_secret(
+        az_creds[TENANT_ID], az_creds[CLIENT_ID], az_creds[CLIENT_SECRET_VALUE], concurrency=concurrency
+    )
 
 
-def assign_app_role(
-    _runner: asyncio.Runner,
-    *,
-    msgraph_api_handler: MSGraphAPIRequestHandler,
-    app_role_display_name: str,
-    application_display_name: str,
-    group_display_name: str,
-):
+def load_snapshot(snapshot_path: str | None, max_age: float) -> Snapshot | None:
     """
-    Helper function for app-role assign flow.
+    Load the snapshot file, exiting with an error message when it cannot be read or it is stale.
 
     Args:
-        _runner: an asyncio Runner instance
-        msgraph_api_handler: an MSGraphAPIRequestHandler instance
-        group_display_name: the Group displayName
-        application_display_name: the Application displayName
-        app_role_display_name: the AppRole displayName
+        snapshot_path: the path to the snapshot file, if any.
+        max_age: the max age of the snapshot in seconds.
 
     Returns:
-        None.
+        Snapshot or None: the snapshot, or None if no path is given.
     """
-    app, group_id, app_role = get_app_group_id_app_role_objects(
-        _runner,
-        msgraph_api_handler=msgraph_api_handler,
-        group_display_name=group_display_name,
-        application_display_name=application_display_name,
-        app_role_display_name=app_role_display_name
-    )
-    service_principal = _runner.run(msgraph_api_handler.api.get_app_service_principal(app.app_id))
-    ret = _runner.run(msgraph_api_handler.get_all_user_ids(group_id))
-    for u_id in ret:
-        try:
-            _runner.run(
-                msgraph_api_handler.grant_app_role_assignment_to_user(u_id, service_principal.id, str(app_role.id))
-            )
-        except MSGraphAPIRequestHandlerError:
-            continue
-
-    logger.info(
-        f'Done with granting \'{app_role_display_name}\' defined by \'{application_display_name}\' '
-        f'to all users member of \'{group_display_name}\''
-    )
+    if snapshot_path is None:
+        return
+    try:
+        snapshot = Snapshot.read(snapshot_path)
+        snapshot.check_freshness(max_age)
+    except SnapshotError as e:
+        sys.exit(str(e))
+    logger.info('Planning against the snapshot %s (%s old)', snapshot_path, snapshot.age)
+    return snapshot
+
+
+def run_flow(
+    flow: str, *, concurrency: int = 1, **kwargs
+) -> list[AppRoleAssignmentResult] | AppRoleAssignmentResult | Snapshot | AppRoleAssignmentPlan:
+    """
+    Run one of the AppRoleAssignmentService flows, exiting with an error message when it does not succeed.
 
+    Args:
+        flow: the name of the flow, one of 'run', 'assign', 'remove', 'sync', 'snapshot', or 'plan'.
+        concurrency: the max number of per-user requests in flight.
+        **kwargs: the keyword arguments of the flow.
 
-def remove_app_role(
-    _runner: asyncio.Runner,
+    Returns:
+        list[AppRoleAssignmentResult], AppRoleAssignmentResult, Snapshot, or AppRoleAssignmentPlan: the outcome of
+        the flow.
+    """
+    async def _run() -> list[AppRoleAssignmentResult] | AppRoleAssignmentResult | Snapshot | AppRoleAssignmentPlan:
+        async with get_service(concurrency) as service:
+            return await getattr(service, flow)(**kwargs)
+
+    try:
+        result = asyncio.run(_run())
+    except AppRoleAssignmentServiceError as e:
+        sys.exit(str(e))
+    results = result if isinstance(result, list) else [result]
+    failed = [
+        principal_id for r in results if isinstance(r, AppRoleAssignmentResult)
+        for principal_id in r.failed
+    ]
+    if failed:
+        sys.exit(f'{kwargs.get("command", flow)} failed for {len(failed)} principal(s): {", ".join(failed)}')
+    return result
+
+
+def run_or_plan(
+    command: str,
+    app_role_display_names: str | list[str],
+    application_display_names: str | list[str],
+    group_display_names: str | list[str],
     *,
-    msgraph_api_handler: MSGraphAPIRequestHandler,
-    app_role_display_name: str,
-    application_display_name: str,
-    group_display_name: str,
+    plan: bool,
+    concurrency: int = 1,
+    **kwargs
 ):
     """
-        Helper function for app-role remove flow.
+    Run the assign, remove, or sync flow, or only print its plan when `plan` is set.
 
     Args:
-        _runner: an asyncio Runner instance
-        msgraph_api_handler: an MSGraphAPIRequestHandler instance
-        group_display_name: the Group displayName
-        application_display_name: the Application displayName
-        app_role_display_name: the AppRole displayName
+        command: the name of the flow, one of 'assign', 'remove', or 'sync'.
+        app_role_display_names: the AppRole displayName(s)
+        application_display_names: the Application displayName(s)
+        group_display_names: the Group displayName(s)
+        plan: whether to print the plan of the flow instead of running it.
+        concurrency: the max number of per-user requests in flight.
+        **kwargs: the keyword arguments of the flow.
 
     Returns:
         None.
     """
-    _, group_id, app_role = get_app_group_id_app_role_objects(
-        _runner,
-        msgraph_api_handler=msgraph_api_handler,
-        group_display_name=group_display_name,
-        application_display_name=application_display_name,
-        app_role_display_name=app_role_display_name
-    )
-    ret = _runner.run(msgraph_api_handler.get_all_user_ids(group_id))
-    for u_id in ret:
-        try:
-            app_role_assignment_id = \
-                _runner.run(
-                    msgraph_api_handler.get_app_role_assignment_id(u_id, application_display_name, str(app_role.id))
-                )
-        except MSGraphAPIRequestHandlerError:
-            continue
-        else:
-            _runner.run(msgraph_api_handler.remove_app_role_assignment_from_user(u_id, app_role_assignment_id))
-
-    logger.info(
-        f'Done with removing \'{app_role_display_name}\' defined by \'{application_display_name}\' '
-        f'from all user members of \'{group_display_name}\''
+    kwargs.update(
+        command=command,
+        app_role_display_names=app_role_display_names,
+        application_display_names=application_display_names,
+        group_display_names=group_display_names
     )
+    if plan:
+        click.echo(run_flow('plan', concurrency=concurrency, **kwargs))
+    else:
+        run_flow('run', concurrency=concurrency, **kwargs)
 
 
 @click.group()
 def cli():
     """The app-role main interface"""
-    pass
+    configure_logging()
 
 
 group_arg = click.argument(
@@ -170,30 +155,60 @@ application_arg = click.argument(
 app_role_arg = click.argument(
     'app_role_display_name', nargs=1, type=click.STRING, metavar='APP_ROLE_DISPLAY_NAME'
 )
+assign_to_option = click.option(
+    '--assign-to', 'assign_to', type=click.Choice(ASSIGN_TO_CHOICES), default=ASSIGN_TO_USERS, show_default=True,
+    help='Target the Group itself, each of its members, or the Group with fallback to the members.'
+)
+concurrency_option = click.option(
+    '--concurrency', 'concurrency', type=click.IntRange(min=1), default=1, show_default=True,
+    help='The max number of per-user requests in flight.'
+)
+snapshot_option = click.option(
+    '--snapshot', 'snapshot_path', type=click.Path(exists=True, dir_okay=False, readable=True), default=None,
+    help='Read the current AppRoleAssignments (and captured Group members) from a snapshot file.'
+)
+max_age_option = click.option(
+    '--max-age', 'max_age', type=click.FloatRange(min=0), default=3600., show_default=True,
+    help='The max age of the snapshot in seconds.'
+)
+plan_option = click.option(
+    '--plan', 'plan', is_flag=True, default=False,
+    help='Print the number of requests and the estimated duration of the command, without performing any write.'
+)
 
 
 @cli.command()
 @app_role_arg
 @application_arg
 @group_arg
-def assign(app_role_display_name: str, application_display_name: str, group_display_name: str):
+@assign_to_option
+@concurrency_option
+@snapshot_option
+@max_age_option
+@plan_option
+def assign(
+    app_role_display_name: str,
+    application_display_name: str,
+    group_display_name: str,
+    assign_to: str,
+    concurrency: int,
+    snapshot_path: str | None,
+    max_age: float,
+    plan: bool
+):
     """
     The `assign` command grants an AppRoleAssignment (via the AppRole defined by the Application)
     to all the users of the Group.
     """
-    az_creds = get_azure_credentials(get_client(), SECRET_ID)
-
-    msgraph_api = MSGraphAPIWrapper(az_creds[TENANT_ID], az_creds[CLIENT_ID], az_creds[CLIENT_SECRET_VALUE])
-    msgraph_api_handler = MSGraphAPIRequestHandler(msgraph_api)
-
-    runner = asyncio.Runner()
-
-    assign_app_role(
-        runner,
-        msgraph_api_handler=msgraph_api_handler,
-        app_role_display_name=app_role_display_name,
-        application_display_name=application_display_name,
-        group_display_name=group_display_name
+    run_or_plan(
+        'assign',
+        app_role_display_name,
+        application_display_name,
+        group_display_name,
+        plan=plan,
+        concurrency=concurrency,
+        assign_to=assign_to,
+        snapshot=load_snapshot(snapshot_path, max_age)
     )
 
 
@@ -201,35 +216,86 @@ def assign(app_role_display_name: str, application_display_name: str, group_disp
 @app_role_arg
 @application_arg
 @group_arg
-def remove(app_role_display_name: str, application_display_name: str, group_display_name: str):
+@assign_to_option
+@concurrency_option
+@snapshot_option
+@max_age_option
+@plan_option
+def remove(
+    app_role_display_name: str,
+    application_display_name: str,
+    group_display_name: str,
+    assign_to: str,
+    concurrency: int,
+    snapshot_path: str | None,
+    max_age: float,
+    plan: bool
+):
     """
     The `remove` command removes an AppRoleAssignment (via the AppRole defined by the Application)
     from all the users of the Group.
     """
-    az_creds = get_azure_credentials(get_client(), SECRET_ID)
-
-    msgraph_api = MSGraphAPIWrapper(az_creds[TENANT_ID], az_creds[CLIENT_ID], az_creds[CLIENT_SECRET_VALUE])
-    msgraph_api_handler = MSGraphAPIRequestHandler(msgraph_api)
+    run_or_plan(
+        'remove',
+        app_role_display_name,
+        application_display_name,
+        group_display_name,
+        plan=plan,
+        concurrency=concurrency,
+        assign_to=assign_to,
+        snapshot=load_snapshot(snapshot_path, max_age)
+    )
 
-    runner = asyncio.Runner()
 
-    remove_app_role(
-        runner,
-        msgraph_api_handler=msgraph_api_handler,
-        app_role_display_name=app_role_display_name,
-        application_display_name=application_display_name,
-        group_display_name=group_display_name
+@cli.command()
+@app_role_arg
+@application_arg
+@group_arg
+@concurrency_option
+@snapshot_option
+@max_age_option
+@plan_option
+def sync(
+    app_role_display_name: str,
+    application_display_name: str,
+    group_display_name: str,
+    concurrency: int,
+    snapshot_path: str | None,
+    max_age: float,
+    plan: bool
+):
+    """
+    The `sync` command grants the AppRole (defined by the Application) to the users of the Group not holding it yet,
+    and removes the user AppRoleAssignments of the AppRole from the users who are not members of the Group.
+    """
+    run_or_plan(
+        'sync',
+        app_role_display_name,
+        application_display_name,
+        group_display_name,
+        plan=plan,
+        concurrency=concurrency,
+        snapshot=load_snapshot(snapshot_path, max_age)
     )
 
 
 @cli.command()
 @click.argument('arg_config', type=click.Path(exists=True, readable=True))
-def from_config(arg_config: Path):
+@concurrency_option
+@snapshot_option
+@max_age_option
+@plan_option
+def from_config(arg_config: Path, concurrency: int, snapshot_path: str | None, max_age: float, plan: bool):
     """
-    Infer command to be run and arguments from a YAML configuration file.
+    Infer command to be run and arguments from a YAML configuration file. The AppRole, Application, and Group
+    displayNames may each be a single name or a list of names, run as a single deduplicated plan.
 
     Args:
         arg_config: the path to the configuration file holding the command and the arguments.
+        concurrency: the max number of per-user requests in flight.
+        snapshot_path: the path to the snapshot file to read the current AppRoleAssignments from.
+        max_age: the max age of the snapshot in seconds.
+        plan: whether to print the plan of the command instead of running it.
 
     Returns:
         None.
@@ -237,40 +303,102 @@ def from_config(arg_config: Path):
     with open(arg_config) as f:
         config = safe_load(f)
 
-    command, app_role_display_name, application_display_name, group_display_name = \
+    command, app_role_display_names, application_display_names, group_display_names = \
         config[COMMAND], config[APP_ROLE_DISPLAY_NAME], config[APPLICATION_DISPLAY_NAME], config[GROUP_DISPLAY_NAME]
+    for key in (APP_ROLE_DISPLAY_NAME, APPLICATION_DISPLAY_NAME, GROUP_DISPLAY_NAME):
+        display_names = config[key]
+        if not isinstance(display_names, str) and not (
+            isinstance(display_names, list) and display_names and all(isinstance(n, str) for n in display_names)
+        ):
+            raise click.BadParameter(f'{key}={display_names!r} must be a displayName or a non-empty list of them')
+    assign_to = config.get(ASSIGN_TO, ASSIGN_TO_USERS)
+    if assign_to not in ASSIGN_TO_CHOICES:
+        raise click.BadParameter(f'{assign_to=} must be one of {ASSIGN_TO_CHOICES}')
 
     logger.info(
-        f'From config: {command=}, {app_role_display_name=}, {application_display_name=}, {group_display_name=}'
+        'From config: command=%r, app_role_display_names=%r, application_display_names=%r, group_display_names=%r, '
+        'assign_to=%r',
+        command, app_role_display_names, application_display_names, group_display_names, assign_to
     )
-
-    az_creds = get_azure_credentials(get_client(), SECRET_ID)
-
-    msgraph_api = MSGraphAPIWrapper(az_creds[TENANT_ID], az_creds[CLIENT_ID], az_creds[CLIENT_SECRET_VALUE])
-    msgraph_api_handler = MSGraphAPIRequestHandler(msgraph_api)
-
-    runner = asyncio.Runner()
+    snapshot = load_snapshot(snapshot_path, max_age)
 
     match command:
-        case 'assign':
-            assign_app_role(
-                runner,
-                msgraph_api_handler=msgraph_api_handler,
-                app_role_display_name=app_role_display_name,
-                application_display_name=application_display_name,
-                group_display_name=group_display_name
+        case 'assign' | 'remove':
+            run_or_plan(
+                command,
+                app_role_display_names,
+                application_display_names,
+                group_display_names,
+                plan=plan,
+                concurrency=concurrency,
+                assign_to=assign_to,
+                snapshot=snapshot
             )
-        case 'remove':
-            remove_app_role(
-                runner,
-                msgraph_api_handler=msgraph_api_handler,
-                app_role_display_name=app_role_display_name,
-                application_display_name=application_display_name,
-                group_display_name=group_display_name
+        case 'sync':
+            run_or_plan(
+                command,
+                app_role_display_names,
+                application_display_names,
+                group_display_names,
+                plan=plan,
+                concurrency=concurrency,
+                snapshot=snapshot
             )
         case _:
             raise NotImplementedError(f'{command=} does not have an implemented flow')
 
 
+@cli.command()
+@application_arg
+@click.option(
+    '--output', '-o', 'output', type=click.Path(dir_okay=False, writable=True), default=None,
+    help='The path of the snapshot file. Defaults to <APPLICATION_DISPLAY_NAME>_<timestamp>.jsonl'
+)
+@click.option(
+    '--group', 'group_display_names', multiple=True, metavar='GROUP_DISPLAY_NAME',
+    help='Also capture the members of the Group. Can be repeated.'
+)
+def snapshot(application_display_name: str, output: str | None, group_display_names: tuple[str, ...]):
+    """
+    The `snapshot` command writes all the AppRoleAssignments granted for the Application to a JSON Lines file,
+    together with the members of the Groups holding an AppRole (and of the requested Groups).
+    """
+    if output is None:
+        output = f'{application_display_name.replace(" ", "_")}_{datetime.now():%Y%m%d%H%M%S}.jsonl'
+    run_flow(
+        'snapshot',
+        application_display_name=application_display_name,
+        path=output,
+        group_display_names=group_display_names
+    )
+
+
+@cli.command()
+@click.argument('old_snapshot', type=click.Path(exists=True, dir_okay=False, readable=True))
+@click.argument('new_snapshot', type=click.Path(exists=True, dir_okay=False, readable=True))
+def diff(old_snapshot: str, new_snapshot: str):
+    """
+    The `diff` command compares two snapshots of the same Application, offline. The added (+) and removed (-)
+    AppRoleAssignments are printed first, then the users who joined (+) or left (-) the captured Groups.
+    """
+    try:
+        old, new = Snapshot.read(old_snapshot), Snapshot.read(new_snapshot)
+        snapshot_diff = diff_snapshots(old, new)
+    except SnapshotError as e:
+        sys.exit(str(e))
+
+    app_roles = old.app_roles | new.app_roles
+    for sign, app_role_assignments in (('+', snapshot_diff.added), ('-', snapshot_diff.removed)):
+        for a in app_role_assignments:
+            click.echo(
+                f'{sign} {app_roles.get(a["app_role_id"], a["app_role_id"])}: '
+                f'{a["principal_type"]} \'{a["principal_display_name"]}\' ({a["principal_id"]})'
+            )
+    for sign, group_members in (('+', snapshot_diff.joined), ('-', snapshot_diff.left)):
+        for group_id, user_ids in group_members.items():
+            for user_id in user_ids:
+                click.echo(f'{sign} Group({group_id}): User({user_id})')
+
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,80 @@
+from dataclasses import dataclass
+from math import ceil
+
+# Assumed average latency of a Microsoft Graph API request
+REQUEST_SECONDS = .3
+# Mean of the random sleep following each per-user write (see MSGraphAPIRequestHandler)
+JITTER_SECONDS = .5
+# Page size of the members and appRoleAssignedTo listings
+PAGE_SIZE = 999
+
+
+def count_pages(items: int, page_size: int = PAGE_SIZE) -> int:
+    """The number of GET requests to list the items, an empty listing still takes one request."""
+    return max(1, ceil(items / page_size))
+
+
+def estimate_seconds(
+        sequential_requests: int,
+        per_user_gets: int,
+        per_user_writes: int,
+        concurrency: int,
+        request_seconds: float = REQUEST_SECONDS
+) -> float:
+    """
+    Estimate the wall-clock time of a flow: the lookups and listings run one after the other, while the per-user
+    requests are spread over `concurrency` workers. Each per-user write is followed by the handler's random sleep.
+
+    Args:
+        sequential_requests: the number of requests issued one after the other.
+        per_user_gets: the number of per-user GET requests.
+        per_user_writes: the number of per-user POST and DELETE requests.
+        concurrency: the max number of per-user requests in flight.
+        request_seconds: the assumed average latency of a request.
+
+    Returns:
+        float: the estimated duration in seconds.
+    """
+    per_user_seconds = per_user_gets * request_seconds + per_user_writes * (request_seconds + JITTER_SECONDS)
+    return sequential_requests * request_seconds + per_user_seconds / concurrency
+
+
+@dataclass
+class AppRoleAssignmentPlan:
+    """
+    The requests a flow would issue, and its estimated duration. `holders` is the number of Group members already
+    holding the AppRole, None when the flow does not need to know it. In 'auto' mode, `fallback` is the plan of the
+    per-user flow run when the Group-level assignment is not allowed.
+    """
+    command: str
+    app_role_display_name: str
+    application_display_name: str
+    group_display_name: str
+    assign_to: str
+    members: int | None = None
+    holders: int | None = None
+    gets: int = 0
+    posts: int = 0
+    deletes: int = 0
+    estimated_seconds: float = 0.
+    fallback: 'AppRoleAssignmentPlan | None' = None
+
+    @property
+    def writes(self) -> int:
+        return self.posts + self.deletes
+
+    def __str__(self) -> str:
+        def _count(value: int | None) -> str:
+            return 'n/a' if value is None else str(value)
+
+        lines = [
+            f'Plan: {self.command} \'{self.app_role_display_name}\' defined by \'{self.application_display_name}\' '
+            f'for \'{self.group_display_name}\' ({self.assign_to})',
+            f'  members: {_count(self.members)}, holders: {_count(self.holders)}',
+            f'  requests: {self.gets} GET, {self.posts} POST, {self.deletes} DELETE',
+            f'  estimated duration: {self.estimated_seconds:.0f}s',
+        ]
+        if self.fallback is not None:
+            lines.append('  if Group-level assignment is not allowed, falling back to:')
+            lines.extend(f'  {line}' for line in str(self.fallback).splitlines())
+        return '\n'.join(lines)
@@ -0,0 +1,956 @@
+import asyncio
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Awaitable, Callable, Iterable, TypeVar
+
+import httpx
+from azure.core.credentials_async import AsyncTokenCredential
+from msgraph.generated.models.application import Application
+from msgraph.generated.models.app_role import AppRole
+from msgraph.generated.models.app_role_assignment import AppRoleAssignment
+from msgraph.generated.models.service_principal import ServicePrincipal
+
+from .constants import ASSIGN_TO_GROUP, ASSIGN_TO_USERS, ASSIGN_TO_AUTO, ASSIGN_TO_CHOICES
+from .exceptions import AppRoleAssignmentBaseException
+from .logging_settings import logging
+from .interfaces.azure.msgraph_api import MSGraphAPIWrapper
+from .handlers.azure import (
+    MSGraphAPIRequestHandler,
+    MSGraphAPIRequestHandlerError,
+    AppRoleAssignmentExistsError,
+    GroupAssignmentNotAllowedError
+)
+from .handlers.helpers import ProgressReporter
+from .snapshot import Snapshot, SnapshotWriter
+from .plan import REQUEST_SECONDS, AppRoleAssignmentPlan, count_pages, estimate_seconds
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class AppRoleAssignmentServiceError(AppRoleAssignmentBaseException):
+    pass
+
+
+@dataclass
+class AppRoleAssignmentTarget:
+    """An AppRole of a flow, with the resolved Application and resource ServicePrincipal defining it."""
+    application_display_name: str
+    application: Application
+    service_principal: ServicePrincipal
+    app_role: AppRole
+
+
+@dataclass
+class AppRoleAssignmentResult:
+    """
+    The outcome of a flow. The lists hold the ids of the principals (users, or the group when `assign_to` is 'group')
+    whose AppRoleAssignment was granted or removed, failed, or did not need any operation.
+    """
+    command: str
+    app_role_display_name: str
+    application_display_name: str
+    group_display_name: str
+    assign_to: str
+    granted: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    failed: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
+def _as_list(display_names: str | Iterable[str]) -> list[str]:
+    """Normalize one or more displayNames to a list without duplicates."""
+    if isinstance(display_names, str):
+        return [display_names]
+    return list(dict.fromkeys(display_names))
+
+
+@dataclass
+class _WorkItem:
+    """A per-user operation of the work queue, recording its outcome in the result of its AppRole."""
+    user_id: str
+    operation: Callable[[], Awaitable[bool]]
+    result: AppRoleAssignmentResult
+    done: list[str]
+
+
+class AppRoleAssignmentService:
+    """
+    Async API for the assign, remove, sync, snapshot, and plan flows, built around an MSGraphAPIRequestHandler.
+
+    The service is meant to be instantiated once and shared: its methods can be awaited concurrently on the caller's
+    event loop, and the concurrent requests of all its flows (lookups, listings, and per-user operations) share
+    `concurrency` slots.
+    Lookup failures raise AppRoleAssignmentServiceError, per-user failures are collected in the returned
+    AppRoleAssignmentResult.
+
+    Example:
+        async with AppRoleAssignmentService.from_credential(credential) as service:
+            result = await service.assign('Viewer', 'The Application', 'The Group')
+    """
+    def __init__(self, msgraph_api_handler: MSGraphAPIRequestHandler, concurrency: int = 1):
+        if concurrency < 1:
+            raise ValueError(f'{concurrency=} must be a positive integer')
+        self.msgraph_api_handler = msgraph_api_handler
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._owns_credential = False
+
+    @classmethod
+    def from_client_secret(
+            cls, tenant_id: str, client_id: str, client_secret: str, *, concurrency: int = 1
+    ) -> 'AppRoleAssignmentService':
+        """
+        Build the service from the App Registration client secret. The credential is closed by `close`.
+
+        Args:
+            tenant_id: the Microsoft Entra ID tenant id.
+            client_id: the App Registration client id.
+            client_secret: the App Registration client secret value.
+            concurrency: the max number of per-user requests in flight for each flow.
+
+        Returns:
+            AppRoleAssignmentService: the service instance.
+        """
+        service = cls(
+            MSGraphAPIRequestHandler(MSGraphAPIWrapper(tenant_id, client_id, client_secret)), concurrency=concurrency
+        )
+        service._owns_credential = True
+        return service
+
+    @classmethod
+    def from_credential(
+            cls,
+            credential: AsyncTokenCredential,
+            *,
+            http_client: httpx.AsyncClient | None = None,
+            scopes: list | None = None,
+            concurrency: int = 1
+    ) -> 'AppRoleAssignmentService':
+        """
+        Build the service from a credential (and optionally an HTTP client) owned by the caller.
+
+        Args:
+            credential: an async Azure credential.
+            http_client: an httpx.AsyncClient to send the Microsoft Graph API requests with.
+            scopes: the Microsoft Graph API scopes.
+            concurrency: the max number of per-user requests in flight for each flow.
+
+        Returns:
+            AppRoleAssignmentService: the service instance.
+        """
+        msgraph_api = MSGraphAPIWrapper(scopes=scopes, credential=credential, http_client=http_client)
+        return cls(MSGraphAPIRequestHandler(msgraph_api), concurrency=concurrency)
+
+    async def close(self):
+        """Close the credential if it was created by the service."""
+        if self._owns_credential:
+            await self.msgraph_api_handler.api.credential.close()
+
+    async def __aenter__(self) -> 'AppRoleAssignmentService':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def resolve_application(self, application_display_name: str) -> tuple[Application, ServicePrincipal]:
+        """
+        Resolve the Application and its ServicePrincipal by displayName.
+
+        Args:
+            application_display_name: the Application displayName
+
+        Returns:
+            tuple: the Application and the ServicePrincipal objects.
+        """
+        try:
+            app = await self.msgraph_api_handler.get_application_if_exists(application_display_name)
+        except MSGraphAPIRequestHandlerError as e:
+            raise AppRoleAssignmentServiceError(f'Could not get \'{application_display_name}\': {e}')
+        if app is None:
+            raise AppRoleAssignmentServiceError(f'\'{application_display_name}\' most likely misspelled!')
+
+        try:
+            service_principal = await self.msgraph_api_handler.get_app_service_principal_if_exists(app.app_id)
+        except MSGraphAPIRequestHandlerError as e:
+            raise AppRoleAssignmentServiceError(
+                f'Could not get the ServicePrincipal of \'{application_display_name}\': {e}'
+            )
+        if service_principal is None:
+            raise AppRoleAssignmentServiceError(f'ServicePrincipal of \'{application_display_name}\' not found!')
+
+        return app, service_principal
+
+    async def run(
+            self,
+            command: str,
+            app_role_display_names: str | Iterable[str],
+            application_display_names: str | Iterable[str],
+            group_display_names: str | Iterable[str],
+            assign_to: str = ASSIGN_TO_USERS,
+            snapshot: Snapshot | None = None
+    ) -> list[AppRoleAssignmentResult]:
+        """
+        Run the assign, remove, or sync flow for the AppRoles defined by the Applications and the Groups, as a single
+        plan: each Group is enumerated once, each Application (and its ServicePrincipal) is resolved once, and the
+        per-user operations are merged into one deduplicated work queue.
+
+        Args:
+            command: the flow to run, one of 'assign', 'remove', or 'sync'.
+            app_role_display_names: the AppRole displayName(s), each has to be defined by at least one Application
+            application_display_names: the Application displayName(s)
+            group_display_names: the Group displayName(s)
+            assign_to: one of 'group', 'users', or 'auto' (Group with fallback to the members), ignored by sync
+            snapshot: a snapshot of one of the Applications, to read the current AppRoleAssignments (and the Group
+                members, if captured) from
+
+        Returns:
+            list: one AppRoleAssignmentResult per AppRole defined by each Application.
+        """
+        assign_to = self._check_command(command, assign_to)
+        group_ids, targets = await self._resolve_matrix(
+            app_role_display_names, application_display_names, group_display_names, snapshot
+        )
+        results = [
+            AppRoleAssignmentResult(
+                command, t.app_role.display_name, t.application_display_name, ', '.join(group_ids), assign_to
+            )
+            for t in targets
+        ]
+
+        # The ids of the Groups whose members are targeted, by AppRole
+        targets_group_ids = [list(group_ids.values()) for _ in targets]
+        if assign_to != ASSIGN_TO_USERS:
+            nested_group_ids = await self._get_nested_group_ids(command, group_ids.values())
+            for target, result, target_group_ids in zip(targets, results, targets_group_ids):
+                target_group_ids[:] = [
+                    group_id for group_display_name, group_id in group_ids.items()
+                    if not await self._run_for_group(
+                        command, target, group_display_name, group_id, result, group_id in nested_group_ids
+                    )
+                ]
+                result.assign_to = ASSIGN_TO_USERS if target_group_ids else ASSIGN_TO_GROUP
+
+        members, listings = await self._get_members_and_listings(command, targets, targets_group_ids, snapshot)
+        work_queue = self._build_work_queue(
+            command, targets, results, targets_group_ids, members, listings, snapshot
+        )
+        await self._run_work_queue(f'Running {command}', work_queue)
+
+        for result in results:
+            logger.info(
+                'Done with %s of \'%s\' defined by \'%s\' for \'%s\' (%s)',
+                command, result.app_role_display_name, result.application_display_name, result.group_display_name,
+                result.assign_to
+            )
+        return results
+
+    async def assign(
+            self,
+            app_role_display_name: str,
+            application_display_name: str,
+            group_display_name: str,
+            assign_to: str = ASSIGN_TO_USERS,
+            snapshot: Snapshot | None = None
+    ) -> AppRoleAssignmentResult:
+        """
+        Grant the AppRole defined by the Application to the Group, or to all its members.
+
+        Args:
+            app_role_display_name: the AppRole displayName
+            application_display_name: the Application displayName
+            group_display_name: the Group displayName
+            assign_to: one of 'group', 'users', or 'auto' (Group with fallback to the members)
+            snapshot: a snapshot of the Application, to skip the users already holding the AppRole
+
+        Returns:
+            AppRoleAssignmentResult: the outcome of the flow.
+        """
+        results = await self.run(
+            'assign', app_role_display_name, application_display_name, group_display_name, assign_to, snapshot
+        )
+        return results[0]
+
+    async def remove(
+            self,
+            app_role_display_name: str,
+            application_display_name: str,
+            group_display_name: str,
+            assign_to: str = ASSIGN_TO_USERS,
+            snapshot: Snapshot | None = None
+    ) -> AppRoleAssignmentResult:
+        """
+        Remove the AppRoleAssignment of the AppRole defined by the Application from the Group, or from all its members.
+
+        Args:
+            app_role_display_name: the AppRole displayName
+            application_display_name: the Application displayName
+            group_display_name: the Group displayName
+            assign_to: one of 'group', 'users', or 'auto' (Group with fallback to the members)
+            snapshot: a snapshot of the Application, to read the AppRoleAssignments of the users from
+
+        Returns:
+            AppRoleAssignmentResult: the outcome of the flow.
+        """
+        results = await self.run(
+            'remove', app_role_display_name, application_display_name, group_display_name, assign_to, snapshot
+        )
+        return results[0]
+
+    async def sync(
+            self,
+            app_role_display_name: str,
+            application_display_name: str,
+            group_display_name: str,
+            snapshot: Snapshot | None = None
+    ) -> AppRoleAssignmentResult:
+        """
+        Make the users holding the AppRole match the members of the Group: the AppRole is granted to the members not
+        holding it yet, and the user AppRoleAssignments of non-members are removed. The current holders are read
+        from the ServicePrincipal appRoleAssignedTo collection, avoiding one GET per user.
+
+        Args:
+            app_role_display_name: the AppRole displayName
+            application_display_name: the Application displayName
+            group_display_name: the Group displayName
+            snapshot: a snapshot of the Application, to read the holders (and the Group members if captured) from
+
+        Returns:
+            AppRoleAssignmentResult: the outcome of the flow.
+        """
+        results = await self.run(
+            'sync', app_role_display_name, application_display_name, group_display_name, snapshot=snapshot
+        )
+        return results[0]
+
+    async def plan(
+            self,
+            command: str,
+            app_role_display_names: str | Iterable[str],
+            application_display_names: str | Iterable[str],
+            group_display_names: str | Iterable[str],
+            assign_to: str = ASSIGN_TO_USERS,
+            snapshot: Snapshot | None = None,
+            request_seconds: float = REQUEST_SECONDS
+    ) -> AppRoleAssignmentPlan:
+        """
+        Count the requests the assign, remove, or sync flow would issue, and estimate its duration, without
+        performing any write. The Group members are counted with $count requests when their ids are not needed;
+        the remove and sync plans read the members and the AppRole holders to count the operations exactly.
+
+        Args:
+            command: the flow to plan, one of 'assign', 'remove', or 'sync'.
+            app_role_display_names: the AppRole displayName(s)
+            application_display_names: the Application displayName(s)
+            group_display_names: the Group displayName(s)
+            assign_to: one of 'group', 'users', or 'auto' (ignored by sync)
+            snapshot: the snapshot the flow would run with
+            request_seconds: the assumed average latency of a request
+
+        Returns:
+            AppRoleAssignmentPlan: the plan of the flow.
+        """
+        assign_to = self._check_command(command, assign_to)
+        group_ids, targets = await self._resolve_matrix(
+            app_role_display_names, application_display_names, group_display_names, snapshot
+        )
+        application_display_names = list(dict.fromkeys(t.application_display_name for t in targets))
+
+        def _new_plan(mode: str) -> AppRoleAssignmentPlan:
+            return AppRoleAssignmentPlan(
+                command,
+                ', '.join(dict.fromkeys(t.app_role.display_name for t in targets)),
+                ', '.join(application_display_names),
+                ', '.join(group_ids),
+                mode
+            )
+
+        # The Group, Application, and ServicePrincipal lookups
+        sequential_gets = len(group_ids) + 2 * len(application_display_names)
+        targets_group_ids = [list(group_ids.values()) for _ in targets]
+        if assign_to == ASSIGN_TO_USERS:
+            return await self._plan_users(
+                _new_plan(ASSIGN_TO_USERS), targets, targets_group_ids, snapshot, sequential_gets, request_seconds
+            )
+
+        group_plan = _new_plan(ASSIGN_TO_GROUP)
+        nested_group_ids = await self._get_nested_group_ids(command, group_ids.values())
+        if command == 'assign':
+            # The two $count requests per Group
+            sequential_gets += 2 * len(group_ids)
+        for target, target_group_ids in zip(targets, targets_group_ids):
+            fallback_group_ids = []
+            for group_id in group_ids.values():
+                if group_id in nested_group_ids:
+                    # Not eligible for the Group-level assignment
+                    fallback_group_ids.append(group_id)
+                    continue
+                sequential_gets += 1
+                try:
+                    granted = await self._get_group_app_role_assignment_id(target, group_id) is not None
+                except MSGraphAPIRequestHandlerError as e:
+                    raise AppRoleAssignmentServiceError(
+                        f'Could not get the AppRoleAssignments of Group({group_id}): {e}'
+                    )
+                if command == 'assign' and not granted:
+                    group_plan.posts += 1
+                    fallback_group_ids.append(group_id)
+                elif command == 'remove' and granted:
+                    group_plan.deletes += 1
+                elif command == 'remove':
+                    fallback_group_ids.append(group_id)
+            target_group_ids[:] = fallback_group_ids if assign_to == ASSIGN_TO_AUTO else []
+        group_plan.gets = sequential_gets
+        group_plan.estimated_seconds = estimate_seconds(
+            sequential_gets + group_plan.writes, 0, 0, self.concurrency, request_seconds
+        )
+        if not any(targets_group_ids):
+            return group_plan
+
+        users_plan = await self._plan_users(
+            _new_plan(ASSIGN_TO_USERS), targets, targets_group_ids, snapshot, sequential_gets, request_seconds
+        )
+        # The Group-level requests precede the per-user ones
+        users_plan.posts += group_plan.posts
+        users_plan.deletes += group_plan.deletes
+        users_plan.estimated_seconds += group_plan.writes * request_seconds
+        if command == 'remove':
+            # The Groups holding no Group-level AppRoleAssignment fall back to the members straight away
+            return users_plan
+        # The fallback follows the (failed) Group-level POSTs
+        group_plan.fallback = users_plan
+        return group_plan
+
+    async def _plan_users(
+            self,
+            plan: AppRoleAssignmentPlan,
+            targets: list[AppRoleAssignmentTarget],
+            targets_group_ids: list[list[str]],
+            snapshot: Snapshot | None,
+            sequential_gets: int,
+            request_seconds: float
+    ) -> AppRoleAssignmentPlan:
+        """Fill in the plan of the per-user operations."""
+        # The member ids are needed to merge several Groups, or to match the members against the holders
+        ids_needed = {}
+        for target, target_group_ids in zip(targets, targets_group_ids):
+            needs_ids = plan.command != 'assign' or len(target_group_ids) > 1 or \
+                self._get_target_snapshot(snapshot, target) is not None
+            for group_id in target_group_ids:
+                ids_needed[group_id] = ids_needed.get(group_id, False) or needs_ids
+
+        members, counts = {}, {}
+        for group_id, needs_ids in ids_needed.items():
+            if snapshot is not None and (user_ids := snapshot.members(group_id)) is not None:
+                members[group_id], counts[group_id] = user_ids, len(user_ids)
+                continue
+            try:
+                users, groups = await self.msgraph_api_handler.count_transitive_members(group_id)
+            except MSGraphAPIRequestHandlerError as e:
+                raise AppRoleAssignmentServiceError(f'Could not count the members of Group({group_id}): {e}')
+            # One listing per (nested) Group, plus the next pages
+            sequential_gets += 1 + groups + count_pages(users) - 1
+            counts[group_id] = users
+            if needs_ids:
+                members[group_id] = await self._get_user_ids(group_id)
+
+        listings = {}
+        for target, target_group_ids in zip(targets, targets_group_ids):
+            if target_group_ids and self._needs_listing(plan.command, target, snapshot, planning=True):
+                service_principal_id = target.service_principal.id
+                if service_principal_id not in listings:
+                    listings[service_principal_id] = await self._get_app_role_assigned_to(service_principal_id)
+                    if plan.command == 'sync':
+                        sequential_gets += count_pages(len(listings[service_principal_id]))
+
+        lookups, holders_count = set(), None
+        for target, target_group_ids in zip(targets, targets_group_ids):
+            if not target_group_ids:
+                continue
+            if not all(group_id in members for group_id in target_group_ids):
+                # A single Group whose members are only counted
+                plan.posts += counts[target_group_ids[0]]
+                continue
+            member_ids = {u_id for group_id in target_group_ids for u_id in members[group_id]}
+            holder_ids = set(self._get_holders(target, snapshot, listings) or ())
+            if plan.command == 'assign' and self._get_target_snapshot(snapshot, target) is None:
+                plan.posts += len(member_ids)
+                continue
+            holders_count = (holders_count or 0) + len(member_ids & holder_ids)
+            match plan.command:
+                case 'assign':
+                    plan.posts += len(member_ids - holder_ids)
+                case 'remove':
+                    plan.deletes += len(member_ids & holder_ids)
+                    if self._get_target_snapshot(snapshot, target) is None:
+                        # One AppRoleAssignment lookup per member and Application
+                        lookups.update((u_id, target.application_display_name) for u_id in member_ids)
+                case 'sync':
+                    plan.posts += len(member_ids - holder_ids)
+                    plan.deletes += len(holder_ids - member_ids)
+
+        group_ids = list(ids_needed)
+        if all(group_id in members for group_id in group_ids):
+            plan.members = len({u_id for group_id in group_ids for u_id in members[group_id]})
+        else:
+            plan.members = sum(counts.values())
+        plan.holders = holders_count
+        plan.gets = sequential_gets + len(lookups)
+        plan.estimated_seconds = estimate_seconds(
+            sequential_gets, len(lookups), plan.writes, self.concurrency, request_seconds
+        )
+        return plan
+
+    async def _resolve_matrix(
+            self,
+            app_role_display_names: str | Iterable[str],
+            application_display_names: str | Iterable[str],
+            group_display_names: str | Iterable[str],
+            snapshot: Snapshot | None
+    ) -> tuple[dict[str, str], list[AppRoleAssignmentTarget]]:
+        """
+        Resolve each distinct Group, Application (and ServicePrincipal), and AppRole once.
+
+        Returns:
+            tuple: the Group ids by displayName, and the AppRoles defined by each Application.
+        """
+        app_role_display_names = _as_list(app_role_display_names)
+        application_display_names = _as_list(application_display_names)
+        group_display_names = _as_list(group_display_names)
+        if not (app_role_display_names and application_display_names and group_display_names):
+            raise AppRoleAssignmentServiceError('At least one AppRole, one Application, and one Group are required')
+
+        group_ids = dict(zip(
+            group_display_names,
+            await asyncio.gather(*(self._bounded(self._get_group_id(name)) for name in group_display_names))
+        ))
+        applications = await asyncio.gather(
+            *(self._bounded(self.resolve_application(name)) for name in application_display_names)
+        )
+
+        targets = [
+            AppRoleAssignmentTarget(application_display_name, app, service_principal, app_role)
+            for application_display_name, (app, service_principal) in zip(application_display_names, applications)
+            for app_role in app.app_roles if app_role.display_name in app_role_display_names
+        ]
+        for app_role_display_name in app_role_display_names:
+            if not any(t.app_role.display_name == app_role_display_name for t in targets):
+                raise AppRoleAssignmentServiceError(f'\'{app_role_display_name}\' most likely misspelled!')
+        if snapshot is not None and not any(self._get_target_snapshot(snapshot, t) for t in targets):
+            raise AppRoleAssignmentServiceError(
+                f'The snapshot of \'{snapshot.application_display_name}\' does not match the Application'
+            )
+        return group_ids, targets
+
+    @staticmethod
+    def _check_command(command: str, assign_to: str) -> str:
+        """Validate the flow arguments, and return the effective assign_to."""
+        if command not in ('assign', 'remove', 'sync'):
+            raise ValueError(f'{command=} must be one of assign, remove, or sync')
+        if assign_to not in ASSIGN_TO_CHOICES:
+            raise ValueError(f'{assign_to=} must be one of {ASSIGN_TO_CHOICES}')
+        return ASSIGN_TO_USERS if command == 'sync' else assign_to
+
+    @staticmethod
+    def _get_target_snapshot(snapshot: Snapshot | None, target: AppRoleAssignmentTarget) -> Snapshot | None:
+        """The snapshot, if it was taken for the Application of the target."""
+        if snapshot is not None and snapshot.service_principal_id == target.service_principal.id:
+            return snapshot
+
+    def _needs_listing(
+            self, command: str, target: AppRoleAssignmentTarget, snapshot: Snapshot | None, planning: bool = False
+    ) -> bool:
+        """Whether the holders of the AppRole have to be read from the appRoleAssignedTo collection."""
+        if self._get_target_snapshot(snapshot, target) is not None:
+            return False
+        return command == 'sync' or (planning and command == 'remove')
+
+    def _get_holders(
+            self,
+            target: AppRoleAssignmentTarget,
+            snapshot: Snapshot | None,
+            listings: dict[str, list[AppRoleAssignment]]
+    ) -> dict[str, str] | None:
+        """
+        The users holding the AppRole, from the snapshot or the appRoleAssignedTo listing.
+
+        Returns:
+            dict | None: the AppRoleAssignment ids by user id, or None if the holders are unknown.
+        """
+        app_role_id = str(target.app_role.id)
+        if (target_snapshot := self._get_target_snapshot(snapshot, target)) is not None:
+            return target_snapshot.holders(app_role_id)
+        if (listing := listings.get(target.service_principal.id)) is not None:
+            return {
+                str(a.principal_id): str(a.id) for a in listing
+                if str(a.app_role_id) == app_role_id and a.principal_type == 'User'
+            }
+
+    async def _get_members_and_listings(
+            self,
+            command: str,
+            targets: list[AppRoleAssignmentTarget],
+            targets_group_ids: list[list[str]],
+            snapshot: Snapshot | None
+    ) -> tuple[dict[str, list[str]], dict[str, list[AppRoleAssignment]]]:
+        """
+        Enumerate each targeted Group once and, when needed, list the appRoleAssignedTo collection of each
+        ServicePrincipal once, concurrently.
+
+        Returns:
+            tuple: the member ids by Group id, and the AppRoleAssignments by ServicePrincipal id.
+        """
+        group_ids = list(dict.fromkeys(g_id for target_group_ids in targets_group_ids for g_id in target_group_ids))
+        service_principal_ids = list(dict.fromkeys(
+            t.service_principal.id for t, target_group_ids in zip(targets, targets_group_ids)
+            if target_group_ids and self._needs_listing(command, t, snapshot)
+        ))
+        user_ids, *listings = await asyncio.gather(
+            asyncio.gather(*(self._bounded(self._get_user_ids(group_id, snapshot)) for group_id in group_ids)),
+            *(self._bounded(self._get_app_role_assigned_to(sp_id)) for sp_id in service_principal_ids)
+        )
+        return dict(zip(group_ids, user_ids)), dict(zip(service_principal_ids, listings))
+
+    def _build_work_queue(
+            self,
+            command: str,
+            targets: list[AppRoleAssignmentTarget],
+            results: list[AppRoleAssignmentResult],
+            targets_group_ids: list[list[str]],
+            members: dict[str, list[str]],
+            listings: dict[str, list[AppRoleAssignment]],
+            snapshot: Snapshot | None
+    ) -> list[_WorkItem]:
+        """
+        Merge the per-user operations of all the AppRoles into one work queue. A user member of several Groups is
+        queued once per AppRole, and the AppRoleAssignments of a user are looked up once per Application.
+        """
+        work_queue = []
+        lookups: dict[tuple[str, str], asyncio.Future] = {}
+
+        def _lookup(user_id: str, application_display_name: str) -> asyncio.Future:
+            key = (user_id, application_display_name)
+            if key not in lookups:
+                lookups[key] = asyncio.ensure_future(
+                    self.msgraph_api_handler.get_app_role_assignment_ids(user_id, application_display_name)
+                )
+            return lookups[key]
+
+        for target, result, target_group_ids in zip(targets, results, targets_group_ids):
+            member_ids = list(dict.fromkeys(u_id for g_id in target_group_ids for u_id in members[g_id]))
+            if not member_ids and command != 'sync':
+                continue
+            holders = self._get_holders(target, snapshot, listings)
+
+            def _grant(user_id: str, _target=target, _result=result):
+                return _WorkItem(user_id, partial(self._grant_to_user, _target, user_id), _result, _result.granted)
+
+            def _remove(user_id: str, app_role_assignment_id: str, _result=result):
+                operation = partial(self._remove_from_user, user_id, app_role_assignment_id)
+                return _WorkItem(user_id, operation, _result, _result.removed)
+
+            match command:
+                case 'assign':
+                    for user_id in member_ids:
+                        if holders is not None and user_id in holders:
+                            result.skipped.append(user_id)
+                        else:
+                            work_queue.append(_grant(user_id))
+                case 'remove' if holders is None:
+                    for user_id in member_ids:
+                        operation = partial(
+                            self._lookup_and_remove_from_user,
+                            partial(_lookup, user_id, target.application_display_name),
+                            str(target.app_role.id),
+                            user_id
+                        )
+                        work_queue.append(_WorkItem(user_id, operation, result, result.removed))
+                case 'remove':
+                    for user_id in member_ids:
+                        if user_id in holders:
+                            work_queue.append(_remove(user_id, holders[user_id]))
+                        else:
+                            result.skipped.append(user_id)
+                case 'sync':
+                    member_set = set(member_ids)
+                    for user_id in member_ids:
+                        if user_id in holders:
+                            result.skipped.append(user_id)
+                        else:
+                            work_queue.append(_grant(user_id))
+                    work_queue.extend(
+                        _remove(user_id, a_id) for user_id, a_id in holders.items() if user_id not in member_set
+                    )
+        return work_queue
+
+    async def _bounded(self, awaitable: Awaitable[T]) -> T:
+        """Await a lookup or a listing in one of the `concurrency` slots of the service."""
+        async with self._semaphore:
+            return await awaitable
+
+    async def _run_work_queue(self, description: str, work_queue: list[_WorkItem]):
+        """
+        Run the per-user operations with at most `concurrency` operations in flight, recording their outcome.
+
+        Args:
+            description: the label of the progress lines.
+            work_queue: the per-user operations.
+
+        Returns:
+            None.
+        """
+        progress = ProgressReporter(description, len(work_queue), logger)
+
+        async def _run(item: _WorkItem):
+            async with self._semaphore:
+                try:
+                    performed = await item.operation()
+                except MSGraphAPIRequestHandlerError as e:
+                    e.log(logging.DEBUG)
+                    item.result.failed.append(item.user_id)
+                    progress.update(error=True)
+                else:
+                    (item.done if performed else item.result.skipped).append(item.user_id)
+                    progress.update(skipped=not performed)
+
+        await asyncio.gather(*map(_run, work_queue))
+        progress.report()
+
+    async def _grant_to_user(self, target: AppRoleAssignmentTarget, user_id: str) -> bool:
+        try:
+            await self.msgraph_api_handler.grant_app_role_assignment_to_user(
+                user_id, target.service_principal.id, str(target.app_role.id)
+            )
+        except AppRoleAssignmentExistsError as e:
+            # Re-running assign on a partly assigned Group: nothing to grant
+            e.log(logging.DEBUG)
+            return False
+        return True
+
+    async def _remove_from_user(self, user_id: str, app_role_assignment_id: str) -> bool:
+        await self.msgraph_api_handler.remove_app_role_assignment_from_user(user_id, app_role_assignment_id)
+        return True
+
+    async def _lookup_and_remove_from_user(
+            self, lookup: Callable[[], Awaitable[dict[str, str]]], app_role_id: str, user_id: str
+    ) -> bool:
+        app_role_assignment_id = (await lookup()).get(app_role_id)
+        if app_role_assignment_id is None:
+            # The user does not hold the AppRole, nothing to remove
+            return False
+        return await self._remove_from_user(user_id, app_role_assignment_id)
+
+    async def _get_group_app_role_assignment_id(self, target: AppRoleAssignmentTarget, group_id: str) -> str | None:
+        """
+        Get the id of the AppRoleAssignment granted to the Group itself, None if the Group does not hold the AppRole.
+        Request errors raise MSGraphAPIRequestHandlerError: they are not a proof the Group holds no assignment.
+        """
+        return await self.msgraph_api_handler.get_group_app_role_assignment_id(
+            group_id, target.application_display_name, str(target.app_role.id)
+        )
+
+    async def _get_nested_group_ids(self, command: str, group_ids: Iterable[str]) -> set[str]:
+        """
+        Get the Groups not eligible for a Group-level AppRoleAssignment: the assignment is not inherited by the
+        members of nested Groups, so granting it would reach fewer users than the per-user flow.
+
+        Returns:
+            set: the ids of the Groups with nested Groups among their transitive members.
+        """
+        if command != 'assign':
+            return set()
+        nested_group_ids = set()
+        for group_id in group_ids:
+            try:
+                _, groups = await self.msgraph_api_handler.count_transitive_members(group_id)
+            except MSGraphAPIRequestHandlerError as e:
+                raise AppRoleAssignmentServiceError(f'Could not count the nested Groups of Group({group_id}): {e}')
+            if groups:
+                nested_group_ids.add(group_id)
+        return nested_group_ids
+
+    async def _run_for_group(
+            self,
+            command: str,
+            target: AppRoleAssignmentTarget,
+            group_display_name: str,
+            group_id: str,
+            result: AppRoleAssignmentResult,
+            has_nested_groups: bool = False
+    ) -> bool:
+        """
+        Grant the AppRole to the Group itself, or remove the AppRoleAssignment of the Group itself.
+
+        Returns:
+            bool: False if the flow has to fall back to the Group members.
+        """
+        if command == 'assign':
+            return await self._grant_to_group(target, group_display_name, group_id, result, has_nested_groups)
+        return await self._remove_from_group(target, group_display_name, group_id, result)
+
+    async def _grant_to_group(
+            self,
+            target: AppRoleAssignmentTarget,
+            group_display_name: str,
+            group_id: str,
+            result: AppRoleAssignmentResult,
+            has_nested_groups: bool = False
+    ) -> bool:
+        """
+        Grant the AppRole to the Group itself. A Group with nested Groups is not eligible, and only a refused
+        (not allowed) Group-level assignment falls back to the members: transient failures are recorded as such.
+
+        Returns:
+            bool: False if the Group-level assignment is not eligible or not allowed.
+        """
+        if has_nested_groups:
+            if result.assign_to == ASSIGN_TO_GROUP:
+                logger.error(
+                    'The members of the Groups nested in \'%s\' do not inherit a Group-level AppRoleAssignment',
+                    group_display_name
+                )
+                result.failed.append(group_id)
+                return True
+            logger.info('\'%s\' has nested Groups, falling back to its members', group_display_name)
+            return False
+        try:
+            granted = await self._get_group_app_role_assignment_id(target, group_id) is not None
+        except MSGraphAPIRequestHandlerError as e:
+            e.log()
+            result.failed.append(group_id)
+            return True
+        if granted:
+            logger.info('\'%s\' is already granted to \'%s\'', target.app_role.display_name, group_display_name)
+            result.skipped.append(group_id)
+            return True
+        try:
+            await self.msgraph_api_handler.grant_app_role_assignment_to_group(
+                group_id, target.service_principal.id, str(target.app_role.id)
+            )
+        except GroupAssignmentNotAllowedError as e:
+            if result.assign_to == ASSIGN_TO_GROUP:
+                e.log()
+                result.failed.append(group_id)
+                return True
+            logger.warning(
+                'Group-level AppRoleAssignment not allowed, falling back to the members of \'%s\': %s',
+                group_display_name, e
+            )
+            return False
+        except MSGraphAPIRequestHandlerError as e:
+            e.log()
+            result.failed.append(group_id)
+            return True
+        else:
+            result.granted.append(group_id)
+            return True
+
+    async def _remove_from_group(
+            self,
+            target: AppRoleAssignmentTarget,
+            group_display_name: str,
+            group_id: str,
+            result: AppRoleAssignmentResult
+    ) -> bool:
+        """
+        Remove the AppRoleAssignment of the Group itself.
+
+        Returns:
+            bool: False if the Group holds no such AppRoleAssignment.
+        """
+        try:
+            app_role_assignment_id = await self._get_group_app_role_assignment_id(target, group_id)
+        except MSGraphAPIRequestHandlerError as e:
+            # A failed lookup is not a proof the Group holds no assignment: neither skip it nor fall back
+            e.log()
+            result.failed.append(group_id)
+            return True
+        if app_role_assignment_id is None:
+            if result.assign_to == ASSIGN_TO_GROUP:
+                logger.warning(
+                    'No group-level AppRoleAssignment of \'%s\' found for \'%s\'',
+                    target.app_role.display_name, group_display_name
+                )
+                result.skipped.append(group_id)
+                return True
+            logger.info(
+                'No group-level AppRoleAssignment found, falling back to the members of \'%s\'', group_display_name
+            )
+            return False
+        try:
+            await self.msgraph_api_handler.remove_app_role_assignment_from_group(group_id, app_role_assignment_id)
+        except MSGraphAPIRequestHandlerError as e:
+            e.log()
+            result.failed.append(group_id)
+        else:
+            result.removed.append(group_id)
+        return True
+
+    async def snapshot(
+            self, application_display_name: str, path: str | Path, group_display_names: Iterable[str] = ()
+    ) -> Snapshot:
+        """
+        Stream all the AppRoleAssignments granted for the ServicePrincipal of the Application to a snapshot file,
+        together with the user members of the Groups holding an AppRole and of the requested Groups.
+
+        Args:
+            application_display_name: the Application displayName
+            path: the path of the snapshot file to write.
+            group_display_names: the displayNames of additional Groups whose members are captured.
+
+        Returns:
+            Snapshot: the written snapshot.
+        """
+        app, service_principal = await self.resolve_application(application_display_name)
+        group_ids = [await self._get_group_id(name) for name in group_display_names]
+        app_roles = {str(r.id): r.display_name for r in app.app_roles}
+
+        with SnapshotWriter(path, application_display_name, service_principal.id, app_roles) as writer:
+            try:
+                async for page in self.msgraph_api_handler.iter_app_role_assigned_to(service_principal.id):
+                    for app_role_assignment in page:
+                        writer.write_assignment(app_role_assignment)
+                        if app_role_assignment.principal_type == 'Group':
+                            group_ids.append(str(app_role_assignment.principal_id))
+            except MSGraphAPIRequestHandlerError as e:
+                raise AppRoleAssignmentServiceError(f'Could not get the AppRoleAssignments: {e}')
+
+            # A failed member listing raises here, so the temporary file is discarded rather than saved with a
+            # truncated membership (a later sync would remove the missing holders)
+            group_ids = list(dict.fromkeys(group_ids))
+            user_ids = await asyncio.gather(*(self._bounded(self._get_user_ids(group_id)) for group_id in group_ids))
+            for group_id, group_user_ids in zip(group_ids, user_ids):
+                writer.write_members(group_id, group_user_ids)
+
+        return Snapshot.read(path)
+
+    async def _get_group_id(self, group_display_name: str) -> str:
+        try:
+            group_id = await self.msgraph_api_handler.get_group_id_if_exists(group_display_name)
+        except MSGraphAPIRequestHandlerError as e:
+            raise AppRoleAssignmentServiceError(f'Could not get \'{group_display_name}\': {e}')
+        if group_id is None:
+            raise AppRoleAssignmentServiceError(f'\'{group_display_name}\' most likely misspelled!')
+        return group_id
+
+    async def _get_user_ids(self, group_id: str, snapshot: Snapshot | None = None) -> list[str]:
+        if snapshot is not None and (user_ids := snapshot.members(group_id)) is not None:
+            return user_ids
+        try:
+            user_ids = await self.msgraph_api_handler.get_all_user_ids(group_id)
+        except MSGraphAPIRequestHandlerError as e:
+            raise AppRoleAssignmentServiceError(f'Could not get the members of Group({group_id}): {e}')
+        # Nested groups can list the same user more than once
+        return list(dict.fromkeys(user_ids))
+
+    async def _get_app_role_assigned_to(self, service_principal_id: str) -> list[AppRoleAssignment]:
+        try:
+            return await self.msgraph_api_handler.get_app_role_assigned_to(service_principal_id)
+        except MSGraphAPIRequestHandlerError as e:
+            raise AppRoleAssignmentServiceError(f'Could not get the AppRole holders: {e}')
@@ -0,0 +1,231 @@
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from .exceptions import AppRoleAssignmentBaseException
+from .logging_settings import logging
+
+logger = logging.getLogger(__name__)
+
+# Snapshot (JSON Lines) record types
+HEADER = 'header'
+ASSIGNMENT = 'assignment'
+MEMBERS = 'members'
+
+
+class SnapshotError(AppRoleAssignmentBaseException):
+    pass
+
+
+@dataclass
+class Snapshot:
+    """
+    The AppRoleAssignments granted for the resource ServicePrincipal of an Application, and the user members of
+    a subset of Groups, at a point in time.
+
+    On disk a snapshot is a JSON Lines file: a header record, followed by one record per AppRoleAssignment and one
+    record per Group listing the ids of its user members.
+    """
+    application_display_name: str
+    service_principal_id: str
+    created_at: datetime
+    app_roles: dict[str, str] = field(default_factory=dict)
+    assignments: list[dict] = field(default_factory=list)
+    group_members: dict[str, list[str]] = field(default_factory=dict)
+
+    @classmethod
+    def read(cls, path: str | Path) -> 'Snapshot':
+        """
+        Load a snapshot file.
+
+        Args:
+            path: the path to the snapshot file.
+
+        Returns:
+            Snapshot: the loaded snapshot.
+        """
+        try:
+            with open(path) as f:
+                header = json.loads(next(f))
+                if header.get('type') != HEADER:
+                    raise SnapshotError(f'{path} is not a snapshot file: missing header')
+                snapshot = cls(
+                    header['application_display_name'],
+                    header['service_principal_id'],
+                    datetime.fromisoformat(header['created_at']),
+                    header['app_roles']
+                )
+                for line in f:
+                    record = json.loads(line)
+                    record_type = record.pop('type')
+                    if record_type == ASSIGNMENT:
+                        snapshot.assignments.append(record)
+                    elif record_type == MEMBERS:
+                        snapshot.group_members[record['group_id']] = record['user_ids']
+        except (OSError, StopIteration, KeyError, ValueError) as e:
+            raise SnapshotError(f'Could not read the snapshot {path}: {e!r}')
+        return snapshot
+
+    @property
+    def age(self) -> timedelta:
+        return datetime.now(timezone.utc) - self.created_at
+
+    def check_freshness(self, max_age: float):
+        """
+        Raise SnapshotError if the snapshot is older than max_age seconds.
+
+        Args:
+            max_age: the max age of the snapshot in seconds.
+
+        Returns:
+            None.
+        """
+        if self.age.total_seconds() > max_age:
+            raise SnapshotError(
+                f'The snapshot of \'{self.application_display_name}\' taken at {self.created_at.isoformat()} '
+                f'is older than {max_age}s'
+            )
+
+    def holders(self, app_role_id: str, principal_type: str = 'User') -> dict[str, str]:
+        """
+        Get the principals holding the AppRole.
+
+        Args:
+            app_role_id: the id of the AppRole.
+            principal_type: the type of the principals to return ('User', 'Group', or 'ServicePrincipal').
+
+        Returns:
+            dict: the AppRoleAssignment ids by principal id.
+        """
+        return {
+            a['principal_id']: a['id'] for a in self.assignments
+            if a['app_role_id'] == app_role_id and a['principal_type'] == principal_type
+        }
+
+    def members(self, group_id: str) -> list[str] | None:
+        """
+        Get the ids of the user members of the Group, or None if the Group membership was not captured.
+        """
+        return self.group_members.get(group_id)
+
+
+class SnapshotWriter:
+    """
+    Stream the records of a snapshot to a JSON Lines file. The file is written to a temporary path and moved in place
+    only on success, so an interrupted run never leaves a truncated snapshot behind.
+    """
+    def __init__(
+            self,
+            path: str | Path,
+            application_display_name: str,
+            service_principal_id: str,
+            app_roles: dict[str, str]
+    ):
+        self.path = Path(path)
+        self.created_at = datetime.now(timezone.utc)
+        self.header = {
+            'type': HEADER,
+            'application_display_name': application_display_name,
+            'service_principal_id': service_principal_id,
+            'created_at': self.created_at.isoformat(),
+            'app_roles': app_roles,
+        }
+        self.assignments = 0
+        self._tmp_path = self.path.with_name(f'.{self.path.name}.tmp')
+        self._file = None
+
+    def __enter__(self) -> 'SnapshotWriter':
+        self._file = open(self._tmp_path, 'w')
+        self._write(self.header)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._file.close()
+        if exc_type is None:
+            os.replace(self._tmp_path, self.path)
+            logger.info('Written %d AppRoleAssignment(s) to %s', self.assignments, self.path)
+        else:
+            self._tmp_path.unlink(missing_ok=True)
+
+    def _write(self, record: dict):
+        self._file.write(json.dumps(record, separators=(',', ':')))
+        self._file.write('\n')
+
+    def write_assignment(self, app_role_assignment):
+        """
+        Args:
+            app_role_assignment: an AppRoleAssignment object.
+
+        Returns:
+            None.
+        """
+        self._write({
+            'type': ASSIGNMENT,
+            'id': app_role_assignment.id,
+            'app_role_id': str(app_role_assignment.app_role_id),
+            'principal_id': str(app_role_assignment.principal_id),
+            'principal_type': app_role_assignment.principal_type,
+            'principal_display_name': app_role_assignment.principal_display_name,
+        })
+        self.assignments += 1
+
+    def write_members(self, group_id: str, user_ids: list[str]):
+        """
+        Args:
+            group_id: the id of the Group.
+            user_ids: the ids of the user members of the Group.
+
+        Returns:
+            None.
+        """
+        self._write({'type': MEMBERS, 'group_id': group_id, 'user_ids': user_ids})
+
+
+@dataclass
+class SnapshotDiff:
+    """
+    The differences between two snapshots: the added and removed AppRoleAssignments (compared by principal and
+    AppRole), and the users who joined or left the Groups captured by both snapshots.
+    """
+    added: list[dict] = field(default_factory=list)
+    removed: list[dict] = field(default_factory=list)
+    joined: dict[str, list[str]] = field(default_factory=dict)
+    left: dict[str, list[str]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.joined or self.left)
+
+
+def diff_snapshots(old: Snapshot, new: Snapshot) -> SnapshotDiff:
+    """
+    Compare two snapshots of the same Application.
+
+    Args:
+        old: the older snapshot.
+        new: the newer snapshot.
+
+    Returns:
+        SnapshotDiff: the differences from old to new.
+    """
+    if old.service_principal_id != new.service_principal_id:
+        raise SnapshotError(
+            f'Cannot compare snapshots of \'{old.application_display_name}\' and \'{new.application_display_name}\''
+        )
+
+    def _by_key(snapshot: Snapshot) -> dict[tuple[str, str], dict]:
+        return {(a['principal_id'], a['app_role_id']): a for a in snapshot.assignments}
+
+    old_assignments, new_assignments = _by_key(old), _by_key(new)
+    diff = SnapshotDiff(
+        added=[a for k, a in new_assignments.items() if k not in old_assignments],
+        removed=[a for k, a in old_assignments.items() if k not in new_assignments],
+    )
+    for group_id in old.group_members.keys() & new.group_members.keys():
+        old_members, new_members = set(old.group_members[group_id]), set(new.group_members[group_id])
+        if joined := sorted(new_members - old_members):
+            diff.joined[group_id] = joined
+        if left := sorted(old_members - new_members):
+            diff.left[group_id] = left
+    return diff
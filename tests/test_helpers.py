@@ -0,0 +1,39 @@
+import logging
+import unittest
+from unittest import mock
+
+from app_role_assignment_cli.handlers.helpers import ProgressReporter
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressReporterTestCase(unittest.TestCase):
+    def test_report(self):
+        with mock.patch('app_role_assignment_cli.handlers.helpers.monotonic', side_effect=[0., 2., 2.]):
+            reporter = ProgressReporter('Granting AppRole', total=4, logger=logger, interval=60.)
+            reporter.update(skipped=True)
+            with self.assertLogs(logger, logging.INFO) as logs:
+                reporter.report()
+
+        self.assertEqual(
+            logs.records[0].getMessage(), 'Granting AppRole: 1/4 processed, 0 error(s), 1 skipped, 0.5/s, ETA 6s'
+        )
+
+    def test_report_without_rate(self):
+        with mock.patch('app_role_assignment_cli.handlers.helpers.monotonic', return_value=0.):
+            reporter = ProgressReporter('Granting AppRole', total=4, logger=logger)
+            with self.assertLogs(logger, logging.INFO) as logs:
+                reporter.report()
+
+        self.assertEqual(
+            logs.records[0].getMessage(), 'Granting AppRole: 0/4 processed, 0 error(s), 0 skipped, 0.0/s, ETA n/a'
+        )
+
+    def test_report_on_empty_queue(self):
+        reporter = ProgressReporter('Granting AppRole', total=0, logger=logger)
+        with self.assertNoLogs(logger):
+            reporter.report()
+
+
+if __name__ == '__main__':
+    unittest.main()
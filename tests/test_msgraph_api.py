@@ -0,0 +1,49 @@
+import unittest
+
+from kiota_abstractions.api_error import APIError
+from msgraph.generated.models.o_data_errors.main_error import MainError
+from msgraph.generated.models.o_data_errors.o_data_error import ODataError
+
+from app_role_assignment_cli.interfaces.azure.msgraph_api import (
+    is_app_role_already_assigned,
+    is_group_assignment_not_allowed,
+)
+
+
+def _odata_error(status_code: int, code: str, message: str) -> ODataError:
+    return ODataError(response_status_code=status_code, error=MainError(code=code, message=message))
+
+
+class ErrorClassificationTestCase(unittest.TestCase):
+    def test_group_assignment_not_allowed(self):
+        for e in (
+            _odata_error(403, 'Authorization_RequestDenied', 'Insufficient privileges to complete the operation.'),
+            _odata_error(400, 'Authorization_RequestDenied', 'Insufficient privileges to complete the operation.'),
+            _odata_error(400, 'Request_BadRequest', 'Group-based assignment requires a Premium license.'),
+        ):
+            with self.subTest(e=e):
+                self.assertTrue(is_group_assignment_not_allowed(e))
+
+    def test_transient_errors_are_not_refusals(self):
+        for e in (
+            _odata_error(429, 'TooManyRequests', 'Too many requests.'),
+            _odata_error(503, 'ServiceUnavailable', 'Service unavailable.'),
+            APIError('Connection reset', response_status_code=None),
+        ):
+            with self.subTest(e=e):
+                self.assertFalse(is_group_assignment_not_allowed(e))
+
+    def test_app_role_already_assigned(self):
+        self.assertTrue(is_app_role_already_assigned(
+            _odata_error(400, 'Request_BadRequest', 'Permission being assigned already exists on the object')
+        ))
+        self.assertFalse(is_app_role_already_assigned(
+            _odata_error(400, 'Request_BadRequest', 'Invalid value specified for property \'principalId\'')
+        ))
+        self.assertFalse(is_app_role_already_assigned(
+            _odata_error(503, 'ServiceUnavailable', 'The object already exists, retry later')
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from app_role_assignment_cli.plan import (
+    JITTER_SECONDS,
+    PAGE_SIZE,
+    AppRoleAssignmentPlan,
+    count_pages,
+    estimate_seconds,
+)
+
+
+class CountPagesTestCase(unittest.TestCase):
+    def test_empty_listing_takes_one_request(self):
+        self.assertEqual(count_pages(0), 1)
+
+    def test_full_pages(self):
+        self.assertEqual(count_pages(PAGE_SIZE), 1)
+        self.assertEqual(count_pages(PAGE_SIZE + 1), 2)
+        self.assertEqual(count_pages(3 * PAGE_SIZE), 3)
+
+    def test_page_size(self):
+        self.assertEqual(count_pages(25, page_size=10), 3)
+
+
+class EstimateSecondsTestCase(unittest.TestCase):
+    def test_sequential_requests(self):
+        self.assertAlmostEqual(estimate_seconds(10, 0, 0, concurrency=4, request_seconds=.5), 5.)
+
+    def test_per_user_requests_are_spread_over_the_workers(self):
+        sequential = estimate_seconds(0, 10, 10, concurrency=1, request_seconds=.3)
+        concurrent = estimate_seconds(0, 10, 10, concurrency=5, request_seconds=.3)
+
+        self.assertAlmostEqual(sequential, 10 * .3 + 10 * (.3 + JITTER_SECONDS))
+        self.assertAlmostEqual(concurrent, sequential / 5)
+
+
+class AppRoleAssignmentPlanTestCase(unittest.TestCase):
+    def test_str(self):
+        plan = AppRoleAssignmentPlan('assign', 'Viewer', 'The Application', 'The Group', 'group', posts=1, gets=4)
+        plan.fallback = AppRoleAssignmentPlan(
+            'assign', 'Viewer', 'The Application', 'The Group', 'users', members=3, posts=4, gets=6
+        )
+
+        lines = str(plan).splitlines()
+
+        self.assertEqual(plan.writes, 1)
+        self.assertEqual(lines[0], "Plan: assign 'Viewer' defined by 'The Application' for 'The Group' (group)")
+        self.assertEqual(lines[1], '  members: n/a, holders: n/a')
+        self.assertEqual(lines[2], '  requests: 4 GET, 1 POST, 0 DELETE')
+        self.assertIn('    members: 3, holders: n/a', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,317 @@
+import unittest
+from collections import Counter
+from types import SimpleNamespace
+from unittest import mock
+
+from msgraph.generated.models.o_data_errors.main_error import MainError
+from msgraph.generated.models.o_data_errors.o_data_error import ODataError
+
+from app_role_assignment_cli.handlers.azure import MSGraphAPIRequestHandler
+from app_role_assignment_cli.interfaces.azure.msgraph_api import is_group_assignment_not_allowed
+from app_role_assignment_cli.service import AppRoleAssignmentService, AppRoleAssignmentServiceError
+
+VIEWER, EDITOR = '00000000-0000-0000-0000-00000000000a', '00000000-0000-0000-0000-00000000000b'
+
+FORBIDDEN = ODataError(
+    response_status_code=403, error=MainError(code='Authorization_RequestDenied', message='Insufficient privileges')
+)
+THROTTLED = ODataError(response_status_code=429, error=MainError(code='TooManyRequests', message='Too many requests'))
+
+
+class FakeMSGraphAPIWrapper:
+    """
+    In-memory stand-in for MSGraphAPIWrapper: one Application defining the Viewer and Editor AppRoles, two Groups
+    sharing members, and the user and Group AppRoleAssignments granted so far.
+    """
+    def __init__(self):
+        self.group_members = {'g1': ['u1', 'u2', 'u3'], 'g2': ['u2', 'u3', 'u4']}
+        # principal_id -> {app_role_id: app_role_assignment_id}
+        self.assignments = {'u1': {VIEWER: 'x1'}, 'u9': {VIEWER: 'x9'}}
+        self.group_assignments = [
+            SimpleNamespace(id='xg', app_role_id=VIEWER, principal_id='g7', principal_type='Group')
+        ]
+        # group_id -> {app_role_id: app_role_assignment_id}, the AppRoleAssignments of the Groups themselves
+        self.group_app_role_assignments = {}
+        self.nested_groups = {'g1': 0, 'g2': 0}
+        self.calls = Counter()
+        self.failing_members = set()
+        self.failing_group_lookups = set()
+        # The APIError raised by the Group-level POST, if any
+        self.group_post_error = None
+
+    async def get_group(self, group_display_name: str):
+        return SimpleNamespace(id={'Group 1': 'g1', 'Group 2': 'g2'}[group_display_name])
+
+    async def get_application(self, application_display_name: str):
+        self.calls['get_application'] += 1
+        return SimpleNamespace(
+            app_id='app',
+            display_name=application_display_name,
+            app_roles=[
+                SimpleNamespace(id=VIEWER, display_name='Viewer'), SimpleNamespace(id=EDITOR, display_name='Editor')
+            ]
+        )
+
+    async def get_app_service_principal(self, app_id: str):
+        return SimpleNamespace(id='00000000-0000-0000-0000-000000000001')
+
+    async def get_all_user_group_members(self, group_id: str):
+        self.calls['get_all_user_group_members'] += 1
+        if group_id in self.failing_members:
+            raise ODataError(response_status_code=503, error=MainError(code='ServiceUnavailable', message='retry'))
+        return [SimpleNamespace(id=user_id) for user_id in self.group_members[group_id]]
+
+    async def get_app_role_assigned_to(self, service_principal_id: str):
+        self.calls['get_app_role_assigned_to'] += 1
+        return self.group_assignments + [
+            SimpleNamespace(id=a_id, app_role_id=app_role_id, principal_id=user_id, principal_type='User')
+            for user_id, app_role_ids in self.assignments.items() for app_role_id, a_id in app_role_ids.items()
+        ]
+
+    async def get_app_role_assignments_for_user(self, user_id: str, resource_display_name: str):
+        self.calls['get_app_role_assignments_for_user'] += 1
+        return [
+            SimpleNamespace(id=a_id, app_role_id=app_role_id)
+            for app_role_id, a_id in self.assignments.get(user_id, {}).items()
+        ]
+
+    async def grant_app_role_assignment_to_user(self, user_id: str, resource_id: str, app_role_id: str):
+        self.calls['grant_app_role_assignment_to_user'] += 1
+        if app_role_id in self.assignments.get(user_id, {}):
+            # The wrapper re-raises this error, see is_app_role_already_assigned
+            raise ODataError(
+                response_status_code=400,
+                error=MainError(code='Request_BadRequest', message='Permission being assigned already exists')
+            )
+        self.assignments.setdefault(user_id, {})[app_role_id] = f'{user_id}-{app_role_id}'
+        return SimpleNamespace(resource_display_name='The Application')
+
+    async def count_transitive_members(self, group_id: str):
+        return len(self.group_members[group_id]), self.nested_groups[group_id]
+
+    async def get_app_role_assignments_for_group(self, group_id: str, resource_display_name: str):
+        self.calls['get_app_role_assignments_for_group'] += 1
+        if group_id in self.failing_group_lookups:
+            raise THROTTLED
+        return [
+            SimpleNamespace(id=a_id, app_role_id=app_role_id, principal_type='Group')
+            for app_role_id, a_id in self.group_app_role_assignments.get(group_id, {}).items()
+        ]
+
+    async def grant_app_role_assignment_to_group(self, group_id: str, resource_id: str, app_role_id: str):
+        self.calls['grant_app_role_assignment_to_group'] += 1
+        if self.group_post_error is not None:
+            # Like the wrapper: refusals are raised, the other request errors return None
+            if is_group_assignment_not_allowed(self.group_post_error):
+                raise self.group_post_error
+            return None
+        self.group_app_role_assignments.setdefault(group_id, {})[app_role_id] = f'{group_id}-{app_role_id}'
+        return SimpleNamespace(resource_display_name='The Application')
+
+    async def delete_group_app_role_assignment(self, group_id: str, app_role_assignment_id: str) -> bool:
+        self.calls['delete_group_app_role_assignment'] += 1
+        app_role_ids = self.group_app_role_assignments.get(group_id, {})
+        for app_role_id, a_id in list(app_role_ids.items()):
+            if a_id == app_role_assignment_id:
+                del app_role_ids[app_role_id]
+                return True
+        return False
+
+    async def delete_app_role_assignment(self, user_id: str, app_role_assignment_id: str) -> bool:
+        self.calls['delete_app_role_assignment'] += 1
+        app_role_ids = self.assignments.get(user_id, {})
+        for app_role_id, a_id in list(app_role_ids.items()):
+            if a_id == app_role_assignment_id:
+                del app_role_ids[app_role_id]
+                return True
+        return False
+
+
+class FakeAPITestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = mock.patch('app_role_assignment_cli.handlers.azure.sleep', new=mock.AsyncMock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.api = FakeMSGraphAPIWrapper()
+        self.service = AppRoleAssignmentService(MSGraphAPIRequestHandler(self.api), concurrency=3)
+
+    def _holders(self, app_role_id: str) -> set[str]:
+        return {user_id for user_id, app_role_ids in self.api.assignments.items() if app_role_id in app_role_ids}
+
+
+class AppRoleAssignmentServiceTestCase(FakeAPITestCase):
+    async def test_build_work_queue_deduplicates_the_members_of_several_groups(self):
+        group_ids, targets = await self.service._resolve_matrix(
+            ['Viewer', 'Editor'], 'The Application', ['Group 1', 'Group 2'], None
+        )
+        results = [SimpleNamespace(granted=[], removed=[], skipped=[]) for _ in targets]
+        targets_group_ids = [list(group_ids.values()) for _ in targets]
+        members = {'g1': ['u1', 'u2', 'u3'], 'g2': ['u2', 'u3', 'u4']}
+
+        work_queue = self.service._build_work_queue('assign', targets, results, targets_group_ids, members, {}, None)
+
+        self.assertEqual(len(work_queue), 8)
+        for result in results:
+            user_ids = sorted(item.user_id for item in work_queue if item.result is result)
+            self.assertEqual(user_ids, ['u1', 'u2', 'u3', 'u4'])
+
+    async def test_remove_shares_the_lookups_across_app_roles(self):
+        self.api.assignments = {'u2': {VIEWER: 'x2', EDITOR: 'y2'}, 'u3': {EDITOR: 'y3'}}
+
+        viewer, editor = await self.service.run(
+            'remove', ['Viewer', 'Editor'], 'The Application', ['Group 1', 'Group 2']
+        )
+
+        # One lookup per member and Application, not per AppRole and Group
+        self.assertEqual(self.api.calls['get_app_role_assignments_for_user'], 4)
+        self.assertEqual(self.api.calls['get_all_user_group_members'], 2)
+        self.assertEqual(self.api.calls['get_application'], 1)
+        self.assertEqual(viewer.removed, ['u2'])
+        self.assertEqual(sorted(editor.removed), ['u2', 'u3'])
+        self.assertEqual(self.api.assignments, {'u2': {}, 'u3': {}})
+
+    async def test_sync_add_and_remove_sets(self):
+        result = await self.service.sync('Viewer', 'The Application', 'Group 1')
+
+        self.assertEqual(sorted(result.granted), ['u2', 'u3'])
+        self.assertEqual(result.removed, ['u9'])
+        self.assertEqual(result.skipped, ['u1'])
+        self.assertTrue(result.ok)
+        self.assertEqual(self._holders(VIEWER), {'u1', 'u2', 'u3'})
+        # The Group-level AppRoleAssignments are left alone
+        self.assertEqual(len(self.api.group_assignments), 1)
+        self.assertEqual(self.api.calls['get_app_role_assignments_for_user'], 0)
+
+    async def test_sync_over_several_groups(self):
+        result, = await self.service.run('sync', 'Viewer', 'The Application', ['Group 1', 'Group 2'])
+
+        self.assertEqual(sorted(result.granted), ['u2', 'u3', 'u4'])
+        self.assertEqual(result.removed, ['u9'])
+        self.assertEqual(self._holders(VIEWER), {'u1', 'u2', 'u3', 'u4'})
+
+    async def test_sync_does_not_remove_on_incomplete_member_listing(self):
+        self.api.failing_members.add('g1')
+
+        with self.assertRaises(AppRoleAssignmentServiceError):
+            await self.service.sync('Viewer', 'The Application', 'Group 1')
+
+        self.assertEqual(self.api.calls['delete_app_role_assignment'], 0)
+        self.assertEqual(self._holders(VIEWER), {'u1', 'u9'})
+
+    async def test_assign_skips_the_users_already_holding_the_app_role(self):
+        result = await self.service.assign('Viewer', 'The Application', 'Group 1')
+
+        self.assertEqual(sorted(result.granted), ['u2', 'u3'])
+        self.assertEqual(result.skipped, ['u1'])
+        self.assertEqual(result.failed, [])
+        self.assertTrue(result.ok)
+
+    async def test_undefined_app_role(self):
+        with self.assertRaises(AppRoleAssignmentServiceError):
+            await self.service.assign('Owner', 'The Application', 'Group 1')
+
+
+class GroupLevelAssignmentTestCase(FakeAPITestCase):
+    async def test_assign_to_group(self):
+        result = await self.service.assign('Viewer', 'The Application', 'Group 1', assign_to='group')
+
+        self.assertEqual(result.granted, ['g1'])
+        self.assertEqual(result.assign_to, 'group')
+        self.assertEqual(self.api.group_app_role_assignments, {'g1': {VIEWER: f'g1-{VIEWER}'}})
+        self.assertEqual(self.api.calls['grant_app_role_assignment_to_user'], 0)
+
+    async def test_assign_to_group_already_granted(self):
+        self.api.group_app_role_assignments = {'g1': {VIEWER: 'xg1'}}
+
+        result = await self.service.assign('Viewer', 'The Application', 'Group 1', assign_to='group')
+
+        self.assertEqual(result.skipped, ['g1'])
+        self.assertTrue(result.ok)
+        self.assertEqual(self.api.calls['grant_app_role_assignment_to_group'], 0)
+
+    async def test_auto_falls_back_to_the_members_when_not_allowed(self):
+        self.api.group_post_error = FORBIDDEN
+
+        result = await self.service.assign('Viewer', 'The Application', 'Group 1', assign_to='auto')
+
+        self.assertEqual(result.assign_to, 'users')
+        self.assertEqual(sorted(result.granted), ['u2', 'u3'])
+        self.assertEqual(result.skipped, ['u1'])
+        self.assertTrue(result.ok)
+
+    async def test_auto_does_not_fall_back_on_transient_errors(self):
+        self.api.group_post_error = THROTTLED
+
+        result = await self.service.assign('Viewer', 'The Application', 'Group 1', assign_to='auto')
+
+        self.assertEqual(result.failed, ['g1'])
+        self.assertFalse(result.ok)
+        self.assertEqual(self.api.calls['grant_app_role_assignment_to_user'], 0)
+
+    async def test_group_mode_records_the_refusal_as_failed(self):
+        self.api.group_post_error = FORBIDDEN
+
+        result = await self.service.assign('Viewer', 'The Application', 'Group 1', assign_to='group')
+
+        self.assertEqual(result.failed, ['g1'])
+        self.assertEqual(self.api.calls['grant_app_role_assignment_to_user'], 0)
+
+    async def test_groups_with_nested_groups_are_not_eligible(self):
+        self.api.nested_groups['g2'] = 1
+
+        auto, = await self.service.run('assign', 'Viewer', 'The Application', ['Group 1', 'Group 2'], 'auto')
+        self.assertEqual(self.api.group_app_role_assignments, {'g1': {VIEWER: f'g1-{VIEWER}'}})
+        self.assertEqual(auto.granted, ['g1', 'u2', 'u3', 'u4'])
+
+        group = await self.service.assign('Viewer', 'The Application', 'Group 2', assign_to='group')
+        self.assertEqual(group.failed, ['g2'])
+        self.assertEqual(self.api.calls['grant_app_role_assignment_to_group'], 1)
+
+    async def test_plan_skips_the_group_level_post_of_nested_groups(self):
+        self.api.nested_groups['g1'] = 1
+
+        plan = await self.service.plan('assign', 'Viewer', 'The Application', 'Group 1', assign_to='auto')
+
+        self.assertEqual(plan.posts, 0)
+        self.assertEqual(plan.fallback.posts, 3)
+
+    async def test_remove_from_group(self):
+        self.api.group_app_role_assignments = {'g1': {VIEWER: 'xg1'}}
+
+        result = await self.service.remove('Viewer', 'The Application', 'Group 1', assign_to='auto')
+
+        self.assertEqual(result.removed, ['g1'])
+        self.assertEqual(result.assign_to, 'group')
+        self.assertEqual(self.api.group_app_role_assignments, {'g1': {}})
+        self.assertEqual(self._holders(VIEWER), {'u1', 'u9'})
+
+    async def test_remove_falls_back_to_the_members_when_the_group_holds_nothing(self):
+        result = await self.service.remove('Viewer', 'The Application', 'Group 1', assign_to='auto')
+
+        self.assertEqual(result.assign_to, 'users')
+        self.assertEqual(result.removed, ['u1'])
+        self.assertEqual(self._holders(VIEWER), {'u9'})
+
+    async def test_remove_from_group_holding_nothing_is_skipped(self):
+        result = await self.service.remove('Viewer', 'The Application', 'Group 1', assign_to='group')
+
+        self.assertEqual(result.skipped, ['g1'])
+        self.assertTrue(result.ok)
+
+    async def test_failed_group_lookup_is_a_failure(self):
+        self.api.group_app_role_assignments = {'g1': {VIEWER: 'xg1'}}
+        self.api.failing_group_lookups.add('g1')
+
+        for assign_to in ('group', 'auto'):
+            with self.subTest(assign_to=assign_to):
+                result = await self.service.remove('Viewer', 'The Application', 'Group 1', assign_to=assign_to)
+
+                self.assertEqual(result.failed, ['g1'])
+                self.assertFalse(result.ok)
+        self.assertEqual(self.api.calls['delete_group_app_role_assignment'], 0)
+        self.assertEqual(self.api.calls['get_app_role_assignments_for_user'], 0)
+        self.assertEqual(self._holders(VIEWER), {'u1', 'u9'})
+
+
+if __name__ == '__main__':
+    unittest.main()
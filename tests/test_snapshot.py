@@ -0,0 +1,100 @@
+import json
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from app_role_assignment_cli.snapshot import Snapshot, SnapshotError, SnapshotWriter, diff_snapshots
+
+
+def _assignment(principal_id: str, app_role_id: str, principal_type: str = 'User') -> SimpleNamespace:
+    return SimpleNamespace(
+        id=f'{principal_id}-{app_role_id}',
+        app_role_id=app_role_id,
+        principal_id=principal_id,
+        principal_type=principal_type,
+        principal_display_name=principal_id.upper(),
+    )
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = Path(self.tmp_dir.name) / 'snapshot.jsonl'
+
+    def _write(self, path: Path, assignments: list, group_members: dict[str, list[str]]) -> Snapshot:
+        with SnapshotWriter(path, 'The Application', 'sp', {'r1': 'Viewer', 'r2': 'Editor'}) as writer:
+            for assignment in assignments:
+                writer.write_assignment(assignment)
+            for group_id, user_ids in group_members.items():
+                writer.write_members(group_id, user_ids)
+        return Snapshot.read(path)
+
+    def test_read_round_trip(self):
+        snapshot = self._write(
+            self.path,
+            [_assignment('u1', 'r1'), _assignment('u2', 'r2'), _assignment('g1', 'r1', 'Group')],
+            {'g1': ['u1', 'u3']}
+        )
+
+        self.assertEqual(snapshot.application_display_name, 'The Application')
+        self.assertEqual(snapshot.service_principal_id, 'sp')
+        self.assertEqual(snapshot.app_roles, {'r1': 'Viewer', 'r2': 'Editor'})
+        self.assertEqual(snapshot.holders('r1'), {'u1': 'u1-r1'})
+        self.assertEqual(snapshot.holders('r1', principal_type='Group'), {'g1': 'g1-r1'})
+        self.assertEqual(snapshot.members('g1'), ['u1', 'u3'])
+        self.assertIsNone(snapshot.members('g2'))
+        snapshot.check_freshness(60)
+
+    def test_read_rejects_missing_header(self):
+        self.path.write_text(json.dumps({'type': 'assignment'}) + '\n')
+        with self.assertRaises(SnapshotError):
+            Snapshot.read(self.path)
+
+    def test_read_rejects_missing_file(self):
+        with self.assertRaises(SnapshotError):
+            Snapshot.read(self.path)
+
+    def test_check_freshness(self):
+        snapshot = Snapshot('The Application', 'sp', datetime.now(timezone.utc) - timedelta(hours=2))
+        with self.assertRaises(SnapshotError):
+            snapshot.check_freshness(3600)
+
+    def test_writer_discards_the_file_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with SnapshotWriter(self.path, 'The Application', 'sp', {}) as writer:
+                writer.write_assignment(_assignment('u1', 'r1'))
+                raise RuntimeError('listing failed')
+
+        self.assertEqual(list(Path(self.tmp_dir.name).iterdir()), [])
+
+    def test_diff_snapshots(self):
+        old = self._write(
+            self.path, [_assignment('u1', 'r1'), _assignment('u2', 'r1')], {'g1': ['u1', 'u2'], 'g2': ['u5']}
+        )
+        new = self._write(
+            Path(self.tmp_dir.name) / 'new.jsonl',
+            [_assignment('u1', 'r1'), _assignment('u3', 'r1')],
+            {'g1': ['u1', 'u3']}
+        )
+
+        diff = diff_snapshots(old, new)
+
+        self.assertEqual([a['principal_id'] for a in diff.added], ['u3'])
+        self.assertEqual([a['principal_id'] for a in diff.removed], ['u2'])
+        self.assertEqual(diff.joined, {'g1': ['u3']})
+        self.assertEqual(diff.left, {'g1': ['u2']})
+        self.assertTrue(diff)
+        self.assertFalse(diff_snapshots(new, new))
+
+    def test_diff_snapshots_of_different_applications(self):
+        old = Snapshot('The Application', 'sp', datetime.now(timezone.utc))
+        new = Snapshot('Another Application', 'another-sp', datetime.now(timezone.utc))
+        with self.assertRaises(SnapshotError):
+            diff_snapshots(old, new)
+
+
+if __name__ == '__main__':
+    unittest.main()